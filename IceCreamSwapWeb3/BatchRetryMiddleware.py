@@ -1,65 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Semaphore
 from time import sleep
+from typing import Callable
 
 from web3.middleware import Web3Middleware
 
 from IceCreamSwapWeb3 import Web3Advanced
 from IceCreamSwapWeb3.EthAdvanced import exponential_retry
 
+# methods for which a null result means the node is not synced that far yet, so they get retried
+NULL_RESULT_RETRY_METHODS = frozenset({"eth_getBlockByNumber", "eth_getBlockByHash"})
+
 
 class BatchRetryMiddleware(Web3Middleware):
     _w3: Web3Advanced
 
     def wrap_make_batch_request(self, make_batch_request):
-        def middleware(requests_info) -> list:
-            if len(requests_info) == 0:
-                # early return if batch to request is empty
-                return []
+        # web3 caches the wrapped function on the provider, so this instance is shared by all threads and callers.
+        # Only state which is meant to be shared lives on it, per call state is passed along instead
+        self._make_batch_request = make_batch_request
+        # limits how many split batches are requested in parallel on top of the calling thread, across all callers
+        self._free_workers = Semaphore(max(self._w3.max_parallel_requests - 1, 0))
+        # make_request wrapped with retries per RPC method, built once instead of for every single request
+        self._retrying_make_request: dict[str, Callable] = {}
+        return self._batch_request
+
+    def _make_request_with_retry(self, method, params):
+        retrying_make_request = self._retrying_make_request.get(method)
+        if retrying_make_request is None:
+            # threads racing here build it twice at worst, which is harmless
+            retrying_make_request = self._retrying_make_request.setdefault(
+                method, exponential_retry(method)(self._make_batch_request.__self__.make_request)
+            )
+        return retrying_make_request(method, params, no_retry=not self._w3.should_retry)
+
+    def _split_and_retry(self, requests_info, out: list, offset: int, full_failure_streak: int) -> None:
+        middle = len(requests_info) // 2
+        self._request_parts_into(
+            [(requests_info[:middle], offset), (requests_info[middle:], offset + middle)], out, full_failure_streak
+        )
+
+    def _request_parts_into(self, parts: list[tuple[list, int]], out: list, full_failure_streak: int = 0) -> None:
+        # request parts in separate threads as far as free workers are available, the first one in this thread
+        acquired = 0
+        while acquired < len(parts) - 1 and self._free_workers.acquire(blocking=False):
+            acquired += 1
+        if acquired == 0:
+            for requests_part, offset in parts:
+                self._request_into(requests_part, out, offset, full_failure_streak)
+            return
+        try:
+            with ThreadPoolExecutor(max_workers=acquired) as executor:
+                futures = [
+                    executor.submit(self._request_into, requests_part, out, offset, full_failure_streak)
+                    for requests_part, offset in parts[1:]
+                ]
+                self._request_into(parts[0][0], out, parts[0][1], full_failure_streak)
+                for future in futures:
+                    future.result()
+        finally:
+            for _ in range(acquired):
+                self._free_workers.release()
 
-            if len(requests_info) > self._w3.rpc_batch_max_size != 0:
-                response = []
-                for start in range(0, len(requests_info), self._w3.rpc_batch_max_size):
-                    response += middleware(requests_info[start:start + self._w3.rpc_batch_max_size])
-                return response
+    def _batch_request(self, requests_info, full_failure_streak: int = 0) -> list:
+        # all sub batches write their responses into this list at their offset instead of concatenating lists
+        response = [None] * len(requests_info)
+        self._request_into(requests_info, response, 0, full_failure_streak)
+        return response
 
-            try:
-                if self._w3.rpc_batch_max_size == 0 or len(requests_info) == 1:
-                    # if RPC does not support batch requests or single request in batch, make individual requests
-                    response = [
-                        exponential_retry(method)(make_batch_request.__self__.make_request)(
-                            method,
-                            params,
-                            no_retry=not self._w3.should_retry
-                        )
-                        for method, params in requests_info
-                    ]
-                else:
-                    response = make_batch_request(requests_info)
-            except Exception as e:
-                assert len(requests_info) > 1
-                print(f"batch RPC call with {len(requests_info)} requests got exception {repr(e)}, splitting and retrying")
+    def _request_into(self, requests_info, out: list, offset: int, full_failure_streak: int = 0) -> None:
+        # full_failure_streak is the number of consecutive retries in which all requests failed, used to back off
+        # increasingly. Kept per call, so failures of one caller do not slow down the others
+        if len(requests_info) == 0:
+            # early return if batch to request is empty
+            return
+
+        # read on every batch, so changes to w3.rpc_batch_max_size apply right away
+        batch_max_size = self._w3.rpc_batch_max_size
+        if len(requests_info) > batch_max_size != 0:
+            # batches too large for the RPC are requested in chunks, which are sent in parallel
+            self._request_parts_into([
+                (requests_info[start:start + batch_max_size], offset + start)
+                for start in range(0, len(requests_info), batch_max_size)
+            ], out, full_failure_streak)
+            return
+
+        try:
+            if batch_max_size == 0 or len(requests_info) == 1:
+                # if RPC does not support batch requests or single request in batch, make individual requests
+                response = [self._make_request_with_retry(method, params) for method, params in requests_info]
             else:
-                if len(response) == len(requests_info):
-                    # find individual failed requests
-                    requests_retry = []
-                    request_indexes: list[tuple[int, int]] = []
-                    for i, (request_single, response_single) in enumerate(zip(requests_info, response)):
-                        if "error" in response_single or response_single.get("result") is None:
-                            request_indexes.append((i, len(requests_retry)))
-                            requests_retry.append(request_single)
+                response = self._make_batch_request(requests_info)
+        except Exception as e:
+            assert len(requests_info) > 1
+            print(f"batch RPC call with {len(requests_info)} requests got exception {repr(e)}, splitting and retrying")
+        else:
+            if not isinstance(response, list):
+                # RPC errors for the whole batch return a single response with the error object
+                print(f"batch request with size {len(requests_info)} failed with {response}. splitting and retrying.")
+            elif len(response) == len(requests_info):
+                # find individual failed requests. Mostly none failed, so only their indexes are collected in one pass
+                failed_indexes = [
+                    i for i, (request_single, response_single) in enumerate(zip(requests_info, response))
+                    if "error" in response_single or "result" not in response_single or (
+                            response_single["result"] is None and request_single[0] in NULL_RESULT_RETRY_METHODS
+                    )
+                ]
 
-                    if len(requests_retry) != 0:
-                        # retry failed requests
-                        print(f"{len(requests_retry)}/{len(requests_info)} requests in batch failed, retrying. Example response: {response[request_indexes[0][0]]}")
-                        if len(requests_retry) == len(requests_info):
-                            # all failed, let's wait a moment before retrying
-                            sleep(1)
-                        response_new = middleware(requests_retry)
-                        for old_idx, new_idx in request_indexes:
-                            response[old_idx] = response_new[new_idx]
+                if len(failed_indexes) != 0:
+                    # retry failed requests
+                    print(f"{len(failed_indexes)}/{len(requests_info)} requests in batch failed, retrying. Example response: {response[failed_indexes[0]]}")
+                    if len(failed_indexes) == len(requests_info):
+                        # all failed, let's wait a moment before retrying. Starts at 10ms and doubles up to 1s
+                        sleep(min(0.01 * 2 ** full_failure_streak, 1))
+                        full_failure_streak += 1
+                    else:
+                        full_failure_streak = 0
+                    response_new = self._batch_request([requests_info[i] for i in failed_indexes], full_failure_streak)
+                    for i, response_single in zip(failed_indexes, response_new):
+                        response[i] = response_single
 
-                    return response
-                else:
-                    print(f"made batch request with size {len(requests_info)} but only received {len(response)} results. splitting and retrying.{f' Sample response: {response[0]}'if len(response) != 0 else ''}")
-            middle = len(requests_info) // 2
-            return middleware(requests_info[:middle]) + middleware(requests_info[middle:])
-        return middleware
\ No newline at end of file
+                out[offset:offset + len(response)] = response
+                return
+            else:
+                print(f"made batch request with size {len(requests_info)} but only received {len(response)} results. splitting and retrying.{f' Sample response: {response[0]}'if len(response) != 0 else ''}")
+        self._split_and_retry(requests_info, out, offset, full_failure_streak)
@@ -0,0 +1,193 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import sleep
+from unittest.mock import MagicMock, call, patch
+
+from web3.providers.base import JSONBaseProvider
+
+from .BatchRetryMiddleware import BatchRetryMiddleware
+
+
+class FakeBatchRPC(JSONBaseProvider):
+    # answers each request with its method and first param, so order and completeness of responses can be checked
+
+    def __init__(self):
+        super().__init__()
+        # behaviour of the next batch requests, consumed one per batch: "dict", "exception", "short" or None
+        self.batch_failures: list[str | None] = []
+        # params of requests which fail the given number of times, and of requests which return null once
+        self.errors: dict = {}
+        self.null_once: set = set()
+        # sizes of all batch requests and the highest number of concurrent requests seen
+        self.batch_sizes: list[int] = []
+        self.max_active = 0
+        self._active = 0
+        self._lock = Lock()
+        self.delay = 0
+
+    def _respond(self, method, params, request_id=0) -> dict:
+        response = {"jsonrpc": "2.0", "id": request_id}
+        with self._lock:
+            param = params[0]
+            if self.errors.get(param, 0) > 0:
+                self.errors[param] -= 1
+                response["error"] = {"code": -32000, "message": "temporary error"}
+            elif param in self.null_once:
+                self.null_once.remove(param)
+                response["result"] = None
+            else:
+                response["result"] = f"{method}:{param}"
+        return response
+
+    def _enter(self):
+        with self._lock:
+            self._active += 1
+            self.max_active = max(self.max_active, self._active)
+        sleep(self.delay)
+
+    def _exit(self):
+        with self._lock:
+            self._active -= 1
+
+    def make_request(self, method, params):
+        self._enter()
+        try:
+            return self._respond(method, params)
+        finally:
+            self._exit()
+
+    def make_batch_request(self, requests):
+        self._enter()
+        try:
+            with self._lock:
+                self.batch_sizes.append(len(requests))
+                failure = self.batch_failures.pop(0) if self.batch_failures else None
+            if failure == "exception":
+                raise ConnectionError("connection reset")
+            if failure == "dict":
+                return {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch too large"}}
+            responses = [self._respond(method, params, request_id) for request_id, (method, params) in enumerate(requests)]
+            if failure == "short":
+                return responses[:-1]
+            return responses
+        finally:
+            self._exit()
+
+
+def requests_for(count: int, method: str = "eth_getBalance") -> list[tuple[str, list]]:
+    return [(method, [i]) for i in range(count)]
+
+
+def results_for(count: int, method: str = "eth_getBalance") -> list[str]:
+    return [f"{method}:{i}" for i in range(count)]
+
+
+class TestBatchRetryMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.provider = FakeBatchRPC()
+        self.w3 = MagicMock()
+        self.w3.rpc_batch_max_size = 100
+        self.w3.should_retry = True
+        self.w3.max_parallel_requests = 4
+        self.batch_request = self.wrap()
+        # the middleware prints every failure
+        print_patcher = patch("builtins.print")
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def wrap(self):
+        return BatchRetryMiddleware(self.w3).wrap_make_batch_request(self.provider.make_batch_request)
+
+    def assertResults(self, responses: list[dict], expected_results: list):
+        self.assertEqual([response["result"] for response in responses], expected_results)
+
+    def test_single_batch(self):
+        self.assertResults(self.batch_request(requests_for(10)), results_for(10))
+        self.assertEqual(self.provider.batch_sizes, [10])
+
+    def test_empty_batch(self):
+        self.assertEqual(self.batch_request([]), [])
+        self.assertEqual(self.provider.batch_sizes, [])
+
+    def test_ordered_across_chunks(self):
+        self.w3.rpc_batch_max_size = 7
+        self.assertResults(self.batch_request(requests_for(50)), results_for(50))
+        # the remaining single request is made on its own, not as batch
+        self.assertEqual(self.provider.batch_sizes, [7] * 7)
+
+    def test_batch_size_read_on_every_batch(self):
+        self.batch_request(requests_for(10))
+        self.w3.rpc_batch_max_size = 5
+        self.batch_request(requests_for(10))
+        self.assertEqual(self.provider.batch_sizes, [10, 5, 5])
+
+    def test_no_batch_support(self):
+        self.w3.rpc_batch_max_size = 0
+        self.assertResults(self.batch_request(requests_for(5)), results_for(5))
+        self.assertEqual(self.provider.batch_sizes, [])
+
+    def test_whole_batch_errors_split(self):
+        for failure in ("dict", "exception", "short"):
+            with self.subTest(failure=failure):
+                self.provider.batch_sizes.clear()
+                self.provider.batch_failures = [failure]
+                self.assertResults(self.batch_request(requests_for(10)), results_for(10))
+                self.assertEqual(self.provider.batch_sizes, [10, 5, 5])
+
+    def test_partial_failures_retried(self):
+        self.provider.errors = {3: 1, 7: 1}
+        self.assertResults(self.batch_request(requests_for(10)), results_for(10))
+        # only the failed requests are requested again
+        self.assertEqual(self.provider.batch_sizes, [10, 2])
+
+    def test_null_result_retried_for_blocks_only(self):
+        self.provider.null_once = {1}
+        self.assertResults(self.batch_request(requests_for(3, "eth_getBlockByNumber")), results_for(3, "eth_getBlockByNumber"))
+
+        # a null receipt means the transaction is not mined yet, which is a valid result
+        self.provider.null_once = {1}
+        responses = self.batch_request(requests_for(3, "eth_getTransactionReceipt"))
+        self.assertResults(responses, ["eth_getTransactionReceipt:0", None, "eth_getTransactionReceipt:2"])
+
+    @patch("IceCreamSwapWeb3.BatchRetryMiddleware.sleep")
+    def test_full_failure_backoff(self, mock_sleep):
+        self.provider.errors = {0: 1, 1: 1}
+        self.batch_request(requests_for(2))
+        self.provider.errors = {0: 1, 1: 1}
+        self.batch_request(requests_for(2))
+        # backs off once per failed round, without carrying the streak over to the next call
+        self.assertEqual(mock_sleep.call_args_list, [call(0.01), call(0.01)])
+
+    @patch("IceCreamSwapWeb3.BatchRetryMiddleware.sleep")
+    def test_full_failure_backoff_increases(self, mock_sleep):
+        self.provider.errors = {0: 3, 1: 3}
+        self.assertResults(self.batch_request(requests_for(2)), results_for(2))
+        self.assertEqual(mock_sleep.call_args_list, [call(0.01), call(0.02), call(0.04)])
+
+    def test_concurrency_limited(self):
+        self.w3.max_parallel_requests = 3
+        self.w3.rpc_batch_max_size = 2
+        self.provider.delay = 0.02
+        self.batch_request = self.wrap()
+        self.assertResults(self.batch_request(requests_for(40)), results_for(40))
+        self.assertLessEqual(self.provider.max_active, 3)
+        self.assertGreater(self.provider.max_active, 1)
+
+    def test_concurrency_limited_across_callers(self):
+        # all callers share the middleware instance and with it the limit
+        self.w3.max_parallel_requests = 3
+        self.w3.rpc_batch_max_size = 2
+        self.provider.delay = 0.02
+        self.batch_request = self.wrap()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(self.batch_request, requests_for(20)) for _ in range(2)]
+            for future in futures:
+                self.assertResults(future.result(), results_for(20))
+        # each caller thread requests itself, on top of the shared workers
+        self.assertLessEqual(self.provider.max_active, 3 + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from eth_utils import keccak
+from .EthAdvanced import EthAdvanced, _bloom_mask, _bloom_may_match, _filter_bloom_masks
+
+
+# logs bloom of a block with a single log, emitted by the contract below with the Transfer event signature as only topic
+BLOCK_LOGS_BLOOM = bytes.fromhex(
+    "00000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000040000000000000000000000000000000"
+    "00000000000000000000000800000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000001000000000"
+    "00000000000000000000000000000000000000000000001000000000000000000000000000000000000000000000000000000000000000000000000000000000"
+    "00000002000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000080000000000000"
+)
+LOG_ADDRESS = "0xF2E246BB76DF876Cef8b38ae84130F4F55De395b"
+LOG_TOPIC = keccak(text="Transfer(address,address,uint256)")
+OTHER_ADDRESS = "0x" + "11" * 20
+OTHER_TOPIC = keccak(text="Approval(address,address,uint256)")
+
+
+class TestLogsBloom(unittest.TestCase):
+
+    def test_bloom_mask_sets_3_bits(self):
+        self.assertEqual(bin(_bloom_mask(LOG_TOPIC)).count("1"), 3)
+
+    def test_bloom_masks_build_block_bloom(self):
+        # the block contains a single log, so its bloom consists of exactly the bits of its address and topic
+        bloom = _bloom_mask(bytes.fromhex(LOG_ADDRESS[2:])) | _bloom_mask(LOG_TOPIC)
+        self.assertEqual(bloom, int.from_bytes(BLOCK_LOGS_BLOOM, "big"))
+
+    def test_bloom_may_match(self):
+        for filter_params in (
+            {"address": [LOG_ADDRESS]},
+            {"address": [OTHER_ADDRESS, LOG_ADDRESS]},
+            {"topics": ["0x" + LOG_TOPIC.hex()]},
+            {"topics": [["0x" + OTHER_TOPIC.hex(), "0x" + LOG_TOPIC.hex()]]},
+            {"address": [LOG_ADDRESS], "topics": ["0x" + LOG_TOPIC.hex(), None]},
+            {},
+        ):
+            with self.subTest(filter_params=filter_params):
+                self.assertTrue(_bloom_may_match(BLOCK_LOGS_BLOOM, _filter_bloom_masks(filter_params)))
+
+    def test_bloom_may_not_match(self):
+        for filter_params in (
+            {"address": [OTHER_ADDRESS]},
+            {"topics": ["0x" + OTHER_TOPIC.hex()]},
+            {"address": [LOG_ADDRESS], "topics": ["0x" + OTHER_TOPIC.hex()]},
+        ):
+            with self.subTest(filter_params=filter_params):
+                self.assertFalse(_bloom_may_match(BLOCK_LOGS_BLOOM, _filter_bloom_masks(filter_params)))
+
+    def test_empty_bloom_always_matches(self):
+        # chains not filling the bloom return it zeroed
+        self.assertTrue(_bloom_may_match(bytes(256), _filter_bloom_masks({"address": [OTHER_ADDRESS]})))
+
+    def test_filter_bloom_masks_bytes_and_str(self):
+        expected = _filter_bloom_masks({"address": [LOG_ADDRESS], "topics": ["0x" + LOG_TOPIC.hex()]})
+        for filter_params in (
+            {"address": LOG_ADDRESS, "topics": ["0x" + LOG_TOPIC.hex()]},
+            {"address": bytes.fromhex(LOG_ADDRESS[2:]), "topics": [LOG_TOPIC]},
+            {"address": [bytes.fromhex(LOG_ADDRESS[2:])], "topics": [[LOG_TOPIC]]},
+        ):
+            with self.subTest(filter_params=filter_params):
+                self.assertEqual(_filter_bloom_masks(filter_params), expected)
+
+    def test_normalize_filter_params_wraps_single_address(self):
+        for address in (LOG_ADDRESS, bytes.fromhex(LOG_ADDRESS[2:])):
+            with self.subTest(address=address):
+                self.assertEqual(EthAdvanced._normalize_filter_params({"address": address})["address"], [address])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+from requests import HTTPError, Response
+from web3.exceptions import Web3RPCError
+
+from .EthAdvanced import RETRY_WAITS, get_retry_after, is_rate_limit_error, is_retriable_error, parse_max_block_range
+
+
+def http_error(status_code: int, retry_after: str | None = None) -> HTTPError:
+    response = Response()
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    return HTTPError(f"{status_code} Client Error", response=response)
+
+
+def rpc_error(code: int, message: str) -> Web3RPCError:
+    return Web3RPCError(message, rpc_response={"jsonrpc": "2.0", "id": 1, "error": {"code": code, "message": message}})
+
+
+class TestIsRateLimitError(unittest.TestCase):
+
+    def test_http_status_429(self):
+        self.assertTrue(is_rate_limit_error(http_error(429)))
+        self.assertFalse(is_rate_limit_error(http_error(500)))
+
+    def test_rpc_error_code(self):
+        self.assertTrue(is_rate_limit_error(rpc_error(429, "slow down")))
+        self.assertFalse(is_rate_limit_error(rpc_error(-32000, "header not found")))
+
+    def test_phrases(self):
+        self.assertTrue(is_rate_limit_error(ValueError("Too Many Requests")))
+        self.assertTrue(is_rate_limit_error(ValueError("daily rate limit exceeded")))
+        self.assertTrue(is_rate_limit_error(ValueError("you have been rate-limited")))
+
+    def test_numbers_in_message_are_no_rate_limit(self):
+        # block numbers, ranges and hashes often contain "429"
+        self.assertFalse(is_rate_limit_error(ValueError("Try with this block range [0x1429AB, 0x1430FF]")))
+        self.assertFalse(is_rate_limit_error(ValueError("query returned more than 10000 results at block 14290000")))
+        self.assertFalse(is_rate_limit_error(rpc_error(-32005, "block 0x429 not found")))
+
+
+
+class TestIsRetriableError(unittest.TestCase):
+
+    def test_http_status(self):
+        for status_code in (408, 425, 429, 500, 502, 503):
+            with self.subTest(status_code=status_code):
+                self.assertTrue(is_retriable_error(http_error(status_code)))
+        for status_code in (400, 401, 403, 404):
+            with self.subTest(status_code=status_code):
+                self.assertFalse(is_retriable_error(http_error(status_code)))
+
+    def test_rpc_error_code(self):
+        self.assertFalse(is_retriable_error(rpc_error(-32601, "the method eth_foo does not exist")))
+        self.assertFalse(is_retriable_error(rpc_error(-32600, "invalid request")))
+        # some RPCs use invalid params for temporary errors like too large responses
+        self.assertTrue(is_retriable_error(rpc_error(-32602, "response size exceeded")))
+        self.assertTrue(is_retriable_error(rpc_error(-32000, "header not found")))
+
+    def test_other_exceptions(self):
+        self.assertTrue(is_retriable_error(ConnectionError("connection reset by peer")))
+        self.assertTrue(is_retriable_error(TimeoutError()))
+
+
+class TestParseMaxBlockRange(unittest.TestCase):
+
+    def test_known_messages(self):
+        for message, max_block_range in (
+            ("exceed maximum block range: 5000", 5000),
+            ("block range is too wide, max range is 2,000", 2000),
+            ("eth_getLogs is limited to a 10,000 range", 10000),
+            ("You can make eth_getLogs requests with up to a 2K block range", 2000),
+            ("Log response size exceeded. You can make eth_getLogs requests with up to a 10000 block range", 10000),
+            ("query timeout exceeded. Consider reducing your block range. ranges over 500 blocks are not supported", 500),
+        ):
+            with self.subTest(message=message):
+                self.assertEqual(parse_max_block_range(rpc_error(-32005, message)), max_block_range)
+
+    def test_unknown_messages(self):
+        for message in (
+            "query returned more than 10000 results",
+            "Try with this block range [0x1429AB, 0x1430FF]",
+            "max range is 0",
+            "",
+        ):
+            with self.subTest(message=message):
+                self.assertIsNone(parse_max_block_range(rpc_error(-32005, message)))
+
+
+class TestGetRetryAfter(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(get_retry_after(http_error(429, retry_after="3")), 3)
+        self.assertEqual(get_retry_after(http_error(503, retry_after="0.5")), 0.5)
+
+    def test_clamped(self):
+        self.assertEqual(get_retry_after(http_error(429, retry_after="3600")), RETRY_WAITS[-1])
+        self.assertEqual(get_retry_after(http_error(429, retry_after="-1")), 0)
+
+    def test_missing_or_http_date(self):
+        self.assertIsNone(get_retry_after(http_error(429)))
+        self.assertIsNone(get_retry_after(http_error(429, retry_after="Wed, 21 Oct 2015 07:28:00 GMT")))
+        self.assertIsNone(get_retry_after(ValueError("no response")))
+
+
+if __name__ == '__main__':
+    unittest.main()
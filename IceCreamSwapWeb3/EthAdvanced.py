@@ -1,8 +1,13 @@
 import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from itertools import chain
 from time import sleep
 from typing import Optional, TypedDict, Sequence
 
 from eth_typing import BlockNumber, Address, ChecksumAddress
+from eth_utils import keccak
 from hexbytes import HexBytes
 from web3.datastructures import AttributeDict
 from web3.eth import Eth
@@ -25,37 +30,178 @@ class FilterParamsExtended(TypedDict, total=False):
     topics: Sequence[_Hash32 | Sequence[_Hash32] | None]
 
 
-def exponential_retry(func_name: str = None):
-    def wrapper(func):
-        def inner(*args, no_retry: bool = False, **kwargs):
-            if no_retry:
-                return func(*args, **kwargs)
+# seconds to wait before each retry, the last value is used for all further retries
+RETRY_WAITS = (0, 1, 2, 4, 8, 16, 30)
 
-            retries = 0
-            while True:
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    if isinstance(e, ContractLogicError):
-                        raise
-                    if retries == 0:
-                        wait_for = 0
-                    elif retries < 6:
-                        wait_for = 2 ** (retries - 1)
-                    else:
-                        wait_for = 30
-                    print(f"Web3Advanced.eth.{func_name or func.__name__} threw \"{repr(e)}\" on {retries+1}th try, retrying in {wait_for}s")
+# JSON-RPC error codes of requests which fail the same way when retried: invalid request and method not found.
+# invalid params (-32602) is missing on purpose, as some RPCs use it for temporary errors like too large responses
+NON_RETRIABLE_RPC_ERROR_CODES = frozenset({-32600, -32601})
+
+# HTTP client error status codes which can succeed when retried: request timeout, too early and too many requests
+RETRIABLE_HTTP_CLIENT_ERRORS = frozenset({408, 425, 429})
+
+# JSON-RPC error codes RPCs use for rate limiting
+RATE_LIMIT_RPC_ERROR_CODES = frozenset({429, -32090})
+
+# whole phrases only, as error messages often contain block numbers or hashes in which e.g. "429" can appear
+RATE_LIMIT_ERROR_PATTERN = re.compile(r"\brate[ -]?limit|\btoo many requests\b", re.IGNORECASE)
+
+# how often a rate limited log range is queried again as is, before it gets split like any other failed range
+MAX_RATE_LIMITED_REQUEUES = int(os.getenv("MAX_RATE_LIMITED_REQUEUES", 5))
 
-                    retries += 1
+
+class ExponentialRetry:
+    # callable object instead of nested closures, keeping the wrapped function and its name in slots
+    __slots__ = ("func", "name")
+
+    def __init__(self, func, name: str):
+        self.func = func
+        self.name = name
+
+    def __call__(self, *args, no_retry: bool = False, **kwargs):
+        if no_retry:
+            return self.func(*args, **kwargs)
+
+        retries = 0
+        while True:
+            try:
+                return self.func(*args, **kwargs)
+            except ContractLogicError:
+                raise
+            except Exception as e:
+                if not is_retriable_error(e):
+                    raise
+                wait_for = get_retry_after(e)
+                if wait_for is None:
+                    wait_for = RETRY_WAITS[min(retries, len(RETRY_WAITS) - 1)]
+                    if wait_for == 0 and is_rate_limit_error(e):
+                        # retrying immediately only makes sense for connection hiccups, not when being rate limited
+                        wait_for = 1
+                print(f"Web3Advanced.eth.{self.name} threw \"{repr(e)}\" on {retries+1}th try, retrying in {wait_for}s")
+
+                retries += 1
+                if wait_for > 0:
                     sleep(wait_for)
-        return inner
+
+
+def exponential_retry(func_name: str = None):
+    def wrapper(func) -> ExponentialRetry:
+        return ExponentialRetry(func, func_name or func.__name__)
     return wrapper
 
 
+def is_retriable_error(e: Exception) -> bool:
+    status_code = getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status_code, int) and 400 <= status_code < 500 and status_code not in RETRIABLE_HTTP_CLIENT_ERRORS:
+        return False
+    rpc_response = getattr(e, "rpc_response", None)
+    if isinstance(rpc_response, dict):
+        error = rpc_response.get("error")
+        if isinstance(error, dict) and error.get("code") in NON_RETRIABLE_RPC_ERROR_CODES:
+            return False
+    return True
+
+
+# error messages in which RPCs tell their maximum eth_getLogs block range, e.g. "exceed maximum block range: 5000"
+MAX_BLOCK_RANGE_ERROR_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"max(?:imum)?(?: block)? range(?: is| of)?:? ([\d,]+k?)\b",
+    r"limited to (?:a )?([\d,]+k?)(?: block)? range",
+    r"up to (?:a )?([\d,]+k?) block range",
+    r"ranges over ([\d,]+k?) blocks",
+))
+
+
+def parse_max_block_range(e: Exception) -> int | None:
+    message = str(e)
+    for pattern in MAX_BLOCK_RANGE_ERROR_PATTERNS:
+        match = pattern.search(message)
+        if match is not None:
+            number = match.group(1).replace(",", "").lower()
+            max_block_range = int(number[:-1]) * 1000 if number.endswith("k") else int(number)
+            return max_block_range if max_block_range > 0 else None
+    return None
+
+
+def get_retry_after(e: Exception) -> float | None:
+    # rate limited HTTP responses can tell us how many seconds to wait via the Retry-After header
+    response = getattr(e, "response", None)
+    retry_after = getattr(response, "headers", {}).get("Retry-After")
+    try:
+        return min(max(float(retry_after), 0), RETRY_WAITS[-1])
+    except (TypeError, ValueError):
+        # header not set or given as HTTP date
+        return None
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    if getattr(getattr(e, "response", None), "status_code", None) == 429:
+        return True
+    rpc_response = getattr(e, "rpc_response", None)
+    if isinstance(rpc_response, dict):
+        error = rpc_response.get("error")
+        if isinstance(error, dict) and error.get("code") in RATE_LIMIT_RPC_ERROR_CODES:
+            return True
+    return RATE_LIMIT_ERROR_PATTERN.search(str(e)) is not None
+
+
+def _retrying_property(prop_name: str) -> property:
+    fget = exponential_retry(func_name=prop_name)(getattr(Eth, prop_name).fget)
+    return property(lambda self: fget(self, no_retry=not self.w3.should_retry))
+
+
+def _topic_to_hex(topic: str | bytes | None) -> str | None:
+    if topic is None or isinstance(topic, str):
+        return topic
+    return "0x" + topic.hex()
+
+
+def _bloom_mask(value: bytes) -> int:
+    # the 3 bits a value sets in a 2048 bit logs bloom, each taken from a pair of bytes of its keccak hash
+    value_hash = keccak(value)
+    mask = 0
+    for i in (0, 2, 4):
+        mask |= 1 << (((value_hash[i] << 8) | value_hash[i + 1]) & 2047)
+    return mask
+
+
+def _to_bloom_value(value: str | bytes) -> bytes:
+    # addresses and topics can be given as hex string or as bytes, only strings need decoding
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value[:2] in ("0x", "0X") else value)
+    return bytes(value)
+
+
+def _filter_bloom_masks(filter_params: FilterParamsExtended) -> list[list[int]]:
+    # one group per filter condition, a block can only contain matching logs if a mask of every group is in its bloom.
+    groups = []
+    addresses = filter_params.get("address")
+    if addresses:
+        if isinstance(addresses, (str, bytes)):
+            addresses = [addresses]
+        groups.append([_bloom_mask(_to_bloom_value(address)) for address in addresses])
+    for topic in filter_params.get("topics") or []:
+        if topic is None:
+            continue
+        topic_options = topic if isinstance(topic, (list, tuple)) else [topic]
+        if len(topic_options) == 0 or None in topic_options:
+            continue
+        groups.append([_bloom_mask(_to_bloom_value(topic_option)) for topic_option in topic_options])
+    return groups
+
+
+def _bloom_may_match(logs_bloom: bytes, bloom_masks: list[list[int]]) -> bool:
+    bloom = int.from_bytes(logs_bloom, "big")
+    if bloom == 0:
+        # an empty bloom is also returned by chains which do not fill it, so it can not be used to skip a block
+        return True
+    return all(any(bloom & mask == mask for mask in group) for group in bloom_masks)
+
+
 class EthAdvanced(Eth):
     w3: Web3Advanced
 
-    METHODS_TO_RETRY = [
+    # tuples, as these are only read once and must not be changed after the properties got wrapped
+    METHODS_TO_RETRY = (
         'fee_history', 'create_access_list', 'estimate_gas',
         'get_transaction', 'get_raw_transaction', 'get_raw_transaction_by_block',
         'send_transaction', 'send_raw_transaction', 'get_balance',
@@ -63,30 +209,32 @@ class EthAdvanced(Eth):
         'wait_for_transaction_receipt', 'get_storage_at', 'replace_transaction',
         'modify_transaction', 'sign', 'sign_transaction', 'sign_typed_data', 'filter',
         'get_filter_changes', 'get_filter_logs', 'uninstall_filter'
-    ]
+    )
 
-    PROPERTIES_TO_RETRY = [
+    PROPERTIES_TO_RETRY = (
         'accounts', 'block_number', 'gas_price',
         'max_priority_fee', 'syncing'
-    ]
+    )
 
     def __init__(self, w3):
         super().__init__(w3=w3)
 
+        # retrying versions of frequently called methods, built once instead of on every call.
+        # _get_logs is looked up on every call, so it can still be replaced on the instance
+        self._call_with_retry = exponential_retry(func_name="call")(super().call)
+        self._get_block_number_with_retry = exponential_retry(func_name="get_block_number")(super().get_block_number)
+        self._get_block_with_retry = exponential_retry(func_name="get_block")(super().get_block)
+        self._get_logs_with_retry = exponential_retry(func_name="get_logs")(lambda filter_params: self._get_logs(filter_params))
+
         if self.w3.should_retry:
             self._wrap_methods_with_retry()
 
         self.chain_id_cached = super()._chain_id()
 
     def _wrap_methods_with_retry(self):
+        # storing the wrapped methods in the instance dict, properties are wrapped once on the class below
         for method_name in self.METHODS_TO_RETRY:
-            method = getattr(self, method_name)
-            setattr(self, method_name, exponential_retry(func_name=method_name)(method))
-
-        for prop_name in self.PROPERTIES_TO_RETRY:
-            prop = getattr(self.__class__, prop_name)
-            wrapped_prop = property(exponential_retry(func_name=prop_name)(prop.fget))
-            setattr(self.__class__, prop_name, wrapped_prop)
+            self.__dict__[method_name] = exponential_retry(func_name=method_name)(getattr(self, method_name))
 
     def call(
             self,
@@ -102,7 +250,7 @@ class EthAdvanced(Eth):
         if not self.w3.should_retry:
             no_retry = True
 
-        return exponential_retry(func_name="call")(super().call)(
+        return self._call_with_retry(
             transaction=transaction,
             block_identifier=block_identifier,
             state_override=state_override,
@@ -111,7 +259,7 @@ class EthAdvanced(Eth):
         )
 
     def get_block_number(self, no_retry: bool = False, ignore_latest_seen_block: bool = False) -> BlockNumber:
-        block_number: BlockNumber = exponential_retry(func_name="get_block_number")(super().get_block_number)(
+        block_number: BlockNumber = self._get_block_number_with_retry(
             no_retry=no_retry or not self.w3.should_retry,
         )
         if not ignore_latest_seen_block and self.w3.latest_seen_block < block_number:
@@ -124,7 +272,7 @@ class EthAdvanced(Eth):
             full_transactions: bool = False,
             no_retry: bool = False
     ) -> BlockData:
-        block: BlockData = exponential_retry(func_name="get_block")(super().get_block)(
+        block: BlockData = self._get_block_with_retry(
             block_identifier=block_identifier,
             full_transactions=full_transactions,
             no_retry=no_retry or not self.w3.should_retry,
@@ -151,28 +299,82 @@ class EthAdvanced(Eth):
             assert "fromBlock" not in filter_params and "toBlock" not in filter_params
             return self.get_logs_inner(filter_params, no_retry=no_retry)
 
-        from_block, from_block_body = self.sanitize_block(filter_params.get("fromBlock", "latest"))
-        to_block, to_block_body = self.sanitize_block(filter_params.get("toBlock", "latest"))
-        filter_params = {**filter_params, "fromBlock": from_block, "toBlock": to_block}
+        # integer bounds are by far the most common, so skip sanitize_block for them
+        from_block, from_block_body = filter_params.get("fromBlock", "latest"), None
+        if not isinstance(from_block, int):
+            from_block, from_block_body = self.sanitize_block(from_block)
+        to_block, to_block_body = filter_params.get("toBlock", "latest"), None
+        if not isinstance(to_block, int):
+            to_block, to_block_body = self.sanitize_block(to_block)
+
+        # the block bounds are passed around as integers, the filter dicts for the RPC are only built when requesting
+        base_params = self._normalize_filter_params(filter_params)
+        base_params.pop("fromBlock", None)
+        base_params.pop("toBlock", None)
+
+        return self._get_logs_resolved(
+            base_params,
+            from_block,
+            to_block,
+            from_block_body=from_block_body,
+            to_block_body=to_block_body,
+            show_progress_bar=show_progress_bar,
+            p_bar=p_bar,
+            no_retry=no_retry,
+            use_subsquid=use_subsquid,
+            get_logs_by_block_hash=get_logs_by_block_hash,
+        )
+
+    def _get_logs_resolved(
+            self,
+            base_params: FilterParamsExtended,
+            from_block: int,
+            to_block: int,
+            from_block_body: BlockData | None = None,
+            to_block_body: BlockData | None = None,
+            show_progress_bar: bool = False,
+            p_bar=None,
+            no_retry: bool = False,
+            use_subsquid: bool = False,
+            get_logs_by_block_hash: bool = False
+    ) -> list[LogReceipt]:
+        # get_logs with block bounds already resolved to integers. Recursive calls use this directly,
+        # so block identifiers are resolved once per get_logs call and known block bodies are not lost.
+        # base_params are the normalized filter params without fromBlock and toBlock
+        filter_block_range = self.w3.filter_block_range
 
         assert to_block >= from_block, f"{from_block=}, {to_block=}"
 
         # if logs for a single block are queried, and we know the block hash, query by it
         if from_block == to_block and (from_block_body or to_block_body):
             block_body = from_block_body if from_block_body else to_block_body
-            single_hash_filter = {**filter_params, "blockHash": block_body["hash"]}
-            del single_hash_filter["fromBlock"]
-            del single_hash_filter["toBlock"]
-            return self.get_logs_inner(single_hash_filter, no_retry=no_retry)
+            return self.get_logs_inner({**base_params, "blockHash": block_body["hash"]}, no_retry=no_retry)
 
         # note: fromBlock and toBlock are both inclusive. e.g. 5 to 6 are 2 blocks
         num_blocks = to_block - from_block + 1
 
-        # check if progress bar needs initialization
+        # a few stable blocks are fastest to get with a single eth_getLogs, skipping Subsquid and range splitting
+        if (
+                num_blocks <= min(self.w3.small_get_logs_threshold, filter_block_range)
+                and not get_logs_by_block_hash
+                and to_block <= self.w3.latest_seen_block - self.w3.unstable_blocks
+        ):
+            # a single attempt without retries, errors like "response too large" are handled by the range splitting below
+            try:
+                results = self._get_logs({**base_params, "fromBlock": from_block, "toBlock": to_block})
+            except Exception:
+                pass
+            else:
+                if p_bar is not None:
+                    p_bar.update(num_blocks)
+                return results
+
+        # check if progress bar needs initialization. Only done here, as the fast paths above finish too quickly to need one
         if show_progress_bar and p_bar is None:
             # local import as tqdm is an optional dependency of this package
             from tqdm import tqdm
-            p_bar = tqdm(total=num_blocks)
+            # rendering at most twice per second, as many small ranges can finish in quick succession
+            p_bar = tqdm(total=num_blocks, mininterval=0.5)
 
         kwargs = dict(
             show_progress_bar=show_progress_bar,
@@ -183,19 +385,43 @@ class EthAdvanced(Eth):
 
         if use_subsquid and from_block < self.w3.latest_seen_block - self.w3.unstable_blocks:
             kwargs["use_subsquid"] = False  # make sure we only try once with Subsquid
-            try:
-                # trying to get logs from SubSquid
-                till_block, results = get_filter(
-                    chain_id=self.chain_id,
-                    filter_params={**filter_params, "toBlock": min(to_block, self.w3.latest_seen_block - self.w3.unstable_blocks)},
-                    partial_allowed=True,
-                    p_bar=p_bar,
+            subsquid_to_block = min(to_block, self.w3.latest_seen_block - self.w3.unstable_blocks)
+            executor = None
+            tail_future = None
+            if to_block > subsquid_to_block:
+                # unstable blocks are never served by Subsquid, so they are requested from the RPC while waiting for Subsquid
+                executor = ThreadPoolExecutor(max_workers=1)
+                tail_future = executor.submit(
+                    self._get_logs_resolved, base_params, subsquid_to_block + 1, to_block, to_block_body=to_block_body, **kwargs
                 )
-                if till_block >= to_block:
-                    return results
-                return results + self.get_logs({**filter_params, "fromBlock": till_block + 1}, **kwargs)
-            except Exception as e:
-                print(f"Getting logs from SubSquid threw exception {repr(e)}, falling back to RPC")
+            try:
+                try:
+                    # trying to get logs from SubSquid
+                    till_block, results = get_filter(
+                        chain_id=self.chain_id,
+                        filter_params={**base_params, "fromBlock": from_block, "toBlock": subsquid_to_block},
+                        partial_allowed=True,
+                        p_bar=p_bar,
+                    )
+                except Exception as e:
+                    print(f"Getting logs from SubSquid threw exception {repr(e)}, falling back to RPC")
+                    till_block, results = from_block - 1, []
+                if till_block < subsquid_to_block:
+                    # extending the Subsquid results in place instead of concatenating both into a third list
+                    results.extend(self._get_logs_resolved(
+                        base_params,
+                        till_block + 1,
+                        subsquid_to_block,
+                        from_block_body=from_block_body if till_block < from_block else None,
+                        to_block_body=to_block_body if subsquid_to_block == to_block else None,
+                        **kwargs
+                    ))
+                if tail_future is not None:
+                    results.extend(tail_future.result())
+            finally:
+                if executor is not None:
+                    executor.shutdown(wait=True)
+            return results
 
         last_stable_block = self.w3.latest_seen_block - self.w3.unstable_blocks
         if get_logs_by_block_hash or to_block > last_stable_block:
@@ -206,7 +432,7 @@ class EthAdvanced(Eth):
             # if only unstable blocks need to be gathered by hash, gather stable blocks as log range
             results: list[LogReceipt] = []
             if not get_logs_by_block_hash and from_block < last_stable_block:
-                results += self.get_logs({**filter_params, "toBlock": last_stable_block}, **kwargs)
+                results += self._get_logs_resolved(base_params, from_block, last_stable_block, from_block_body=from_block_body, **kwargs)
                 from_block = last_stable_block + 1
                 assert to_block >= from_block
                 num_blocks = to_block - from_block + 1
@@ -218,67 +444,154 @@ class EthAdvanced(Eth):
                 blocks: list[BlockData] = batch.execute()
             assert len(blocks) == num_blocks
 
-            # make sure chain of blocks is consistent with each block building on the previous one
-            for i, block_number in enumerate(range(from_block, to_block + 1)):
-                block = blocks[i]
-                if i != 0:
-                    if block["parentHash"] != blocks[i-1]["hash"]:
-                        raise ForkedBlock(f"expected={blocks[i-1]['hash'].to_0x_hex()}, actual={block['parentHash'].to_0x_hex()}")
-                if from_block_body is not None and from_block_body["number"] == block_number:
-                    if block["hash"] != from_block_body["hash"]:
-                        raise ForkedBlock(f"expected={from_block_body['hash'].to_0x_hex()}, actual={block['hash'].to_0x_hex()}")
-                if to_block_body is not None and to_block_body["number"] == block_number:
-                    if block["hash"] != to_block_body["hash"]:
-                        raise ForkedBlock(f"expected={to_block_body['hash'].to_0x_hex()}, actual={block['hash'].to_0x_hex()}")
-
-            single_hash_filter = filter_params.copy()
-            del single_hash_filter["fromBlock"]
-            del single_hash_filter["toBlock"]
-            with self.w3.batch_requests() as batch:
-                batch.add_mapping({
-                    self.w3.eth._get_logs: [{**single_hash_filter, "blockHash": block["hash"]} for block in blocks]
-                })
-                results_per_block: list[list[LogReceipt]] = batch.execute()
-            assert len(results_per_block) == num_blocks
+            # make sure chain of blocks is consistent with each block building on the previous one.
+            # comparing the lists of hashes at once, only searching for the mismatch if there is one
+            hashes = [block["hash"] for block in blocks]
+            parent_hashes = [block["parentHash"] for block in blocks]
+            if hashes[:-1] != parent_hashes[1:]:
+                i = next(i for i in range(1, num_blocks) if parent_hashes[i] != hashes[i - 1])
+                raise ForkedBlock(f"expected={hashes[i - 1].to_0x_hex()}, actual={parent_hashes[i].to_0x_hex()}")
+            for block_body in (from_block_body, to_block_body):
+                if block_body is not None and from_block <= block_body["number"] <= to_block:
+                    block_hash = hashes[block_body["number"] - from_block]
+                    if block_hash != block_body["hash"]:
+                        raise ForkedBlock(f"expected={block_body['hash'].to_0x_hex()}, actual={block_hash.to_0x_hex()}")
+
+            # opt-in: only query blocks whose logs bloom says they can contain matching logs. Bloom filters have no false
+            # negatives, but some chains leave e.g. system logs out of the bloom, which would then be lost
+            blocks_to_query = blocks
+            if self.w3.use_logs_bloom:
+                bloom_masks = _filter_bloom_masks(base_params)
+                blocks_to_query = [
+                    block for block in blocks
+                    if "logsBloom" not in block or _bloom_may_match(block["logsBloom"], bloom_masks)
+                ]
+
+            results_per_block: list[list[LogReceipt]] = []
+            if len(blocks_to_query) != 0:
+                with self.w3.batch_requests() as batch:
+                    batch.add_mapping({
+                        self.w3.eth._get_logs: [{**base_params, "blockHash": block["hash"]} for block in blocks_to_query]
+                    })
+                    results_per_block = batch.execute()
+            assert len(results_per_block) == len(blocks_to_query)
             if p_bar is not None:
                 p_bar.update(len(blocks))
-            results += sum(results_per_block, [])
+            results.extend(chain.from_iterable(results_per_block))
             return results
 
         # getting logs for a single block, which is not at the chain head. No drama
         if num_blocks == 1:
-            return self.get_logs_inner(filter_params, no_retry=no_retry)
-
-        # if we already know that the filter range is too large, split it
-        if num_blocks > filter_block_range:
-            results = []
-            for filter_start in range(from_block, to_block + 1, filter_block_range):
-                results += self.get_logs({
-                    **filter_params,
-                    "fromBlock": filter_start,
-                    "toBlock": min(filter_start + filter_block_range - 1, to_block),
-                }, **kwargs)
-            return results
+            return self.get_logs_inner({**base_params, "fromBlock": from_block, "toBlock": to_block}, no_retry=no_retry)
+
+        return self._get_logs_in_ranges(base_params, from_block, to_block, p_bar=p_bar, no_retry=no_retry)
+
+    @staticmethod
+    def _normalize_filter_params(filter_params: FilterParamsExtended) -> FilterParamsExtended:
+        # bringing addresses and topics into the form web3 sends them in once,
+        # instead of web3 converting them again for every sub range or block requested
+        normalized_filter_params = {**filter_params}
+        if isinstance(filter_params.get("address"), (str, bytes)):
+            normalized_filter_params["address"] = [filter_params["address"]]
+        if filter_params.get("topics") is not None:
+            normalized_filter_params["topics"] = [
+                [_topic_to_hex(single_topic) for single_topic in topic] if isinstance(topic, (list, tuple))
+                else _topic_to_hex(topic)
+                for topic in filter_params["topics"]
+            ]
+        return normalized_filter_params
+
+    def _get_logs_in_ranges(
+            self,
+            base_params: FilterParams,
+            from_block: int,
+            to_block: int,
+            p_bar=None,
+            no_retry: bool = False,
+    ) -> list[LogReceipt]:
+        # the block range is split into sub ranges, which are queried in parallel.
+        # if querying a sub range fails, it is split in half and both halves are queued again.
+        # the size of new sub ranges adapts: it is halved on failures and slowly grows back on successes,
+        # but never up to a size that already failed, so it does not oscillate around the size the node can handle.
+        # the number of parallel requests adapts the same way to rate limiting
+        max_range_size = self.w3.filter_block_range
+        range_size = max_range_size
+        observed_bad = max_range_size + 1
+        next_from = from_block
+        pending: deque[tuple[int, int]] = deque()
+        results_per_range: dict[int, list[LogReceipt]] = {}
+        rate_limited_requeues: dict[tuple[int, int], int] = {}
+
+        max_workers = max(1, self.w3.max_parallel_requests)
+        concurrency = float(max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running: dict[Future, tuple[int, int]] = {}
+            while pending or running or next_from <= to_block:
+                while len(running) < int(concurrency) and (pending or next_from <= to_block):
+                    if pending:
+                        range_from, range_to = pending.popleft()
+                    else:
+                        range_from, range_to = next_from, min(next_from + range_size - 1, to_block)
+                        next_from = range_to + 1
+                    future = executor.submit(self._get_logs_range, base_params, range_from, range_to, no_retry)
+                    running[future] = (range_from, range_to)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    range_from, range_to = running.pop(future)
+                    num_range_blocks = range_to - range_from + 1
+                    try:
+                        results_per_range[range_from] = future.result()
+                    except Exception as e:
+                        if range_from == range_to:
+                            # single blocks are already retried, nothing left to split
+                            raise
+                        requeues = rate_limited_requeues.get((range_from, range_to), 0)
+                        if requeues < MAX_RATE_LIMITED_REQUEUES and is_rate_limit_error(e):
+                            # the range is fine, we are just too fast. Query it again with fewer parallel requests
+                            if concurrency < 2:
+                                retry_after = get_retry_after(e)
+                                sleep(1 if retry_after is None else retry_after)
+                            concurrency = max(1.0, concurrency / 2)
+                            rate_limited_requeues[(range_from, range_to)] = requeues + 1
+                            pending.appendleft((range_from, range_to))
+                            continue
+                        max_block_range = parse_max_block_range(e)
+                        if max_block_range is not None and max_block_range < num_range_blocks:
+                            # the RPC told us its limit, so directly use it instead of halving towards it
+                            self.w3.filter_block_range = min(self.w3.filter_block_range, max_block_range)
+                            observed_bad = min(observed_bad, max_block_range + 1)
+                            range_size = min(range_size, max_block_range)
+                            pending.extend(
+                                (start, min(start + max_block_range - 1, range_to))
+                                for start in range(range_from, range_to + 1, max_block_range)
+                            )
+                            continue
+                        observed_bad = min(observed_bad, num_range_blocks)
+                        range_size = max(1, min(range_size, num_range_blocks // 2))
+                        mid_block = (range_from + range_to) // 2
+                        pending.append((range_from, mid_block))
+                        pending.append((mid_block + 1, range_to))
+                    else:
+                        concurrency = min(max_workers, concurrency + 0.5)
+                        if num_range_blocks >= range_size:
+                            range_size = min(max_range_size, observed_bad - 1, range_size + max(1, range_size // 10))
+                        if p_bar is not None:
+                            p_bar.update(num_range_blocks)
 
-        # get logs and split on exception
-        try:
-            events = self._get_logs(filter_params)
-            if p_bar is not None:
-                p_bar.update(num_blocks)
-            return events
-        except Exception:
-            # split the filter range and try again
-            mid_block = (from_block + to_block) // 2
-            left_filter = {**filter_params, "toBlock": mid_block}
-            right_filter = {**filter_params, "fromBlock": mid_block + 1}
-            return self.get_logs(left_filter, **kwargs) + self.get_logs(right_filter, **kwargs)
+        return list(chain.from_iterable(results_per_range[start] for start in sorted(results_per_range)))
 
+    def _get_logs_range(self, base_params: FilterParams, from_block: int, to_block: int, no_retry: bool = False):
+        range_filter = {**base_params, "fromBlock": from_block, "toBlock": to_block}
+        if from_block == to_block:
+            return self.get_logs_inner(range_filter, no_retry=no_retry)
+        return self._get_logs(range_filter)
 
     def sanitize_block(self, block: BlockIdentifier | BlockData) -> tuple[int, BlockData | None]:
         if isinstance(block, int):
             block_body = None
             block_number = block
-        elif isinstance(block, AttributeDict) or isinstance(block, dict):
+        elif isinstance(block, (dict, AttributeDict)):  # AttributeDict is a Mapping, not a dict subclass
             block_body = block
             block_number = block["number"]
         else:
@@ -289,12 +602,22 @@ class EthAdvanced(Eth):
     def get_logs_inner(self, filter_params: FilterParams, no_retry: bool = False):
         if not self.w3.should_retry:
             no_retry = True
-        return exponential_retry(func_name="get_logs")(self._get_logs)(filter_params, no_retry=no_retry)
+        return self._get_logs_with_retry(filter_params, no_retry=no_retry)
 
     def _chain_id(self):
         # usually this causes an RPC call and is used in every eth_call. Getting it once in the init and then not again.
         return self.chain_id_cached
 
+    @property
+    def chain_id(self) -> int:
+        # skipping the indirection of the base property through _chain_id
+        return self.chain_id_cached
+
+
+# wrapping properties once on the class instead of on every instantiation, which would stack the retry wrappers
+for _prop_name in EthAdvanced.PROPERTIES_TO_RETRY:
+    setattr(EthAdvanced, _prop_name, _retrying_property(_prop_name))
+
 
 def main(
         node_url="https://rpc-core.icecreamswap.com",
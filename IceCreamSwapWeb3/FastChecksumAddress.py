@@ -6,22 +6,36 @@ from eth_typing import ChecksumAddress
 CACHE_SIZE = int(os.getenv("CHECKSUM_CACHE_SIZE", 1000))
 CHECKSUM_CACHE = {}
 
-def to_checksum_address(address: str) -> ChecksumAddress:
-    """Fast checksum address with caching."""
-    normalized_address = address.lower().replace("0x", "")
-    assert len(normalized_address) == 40, "Address has incorrect length"
+# translation tables to 0x20 (the ASCII lower/upper case bit) where a character needs to be upper case:
+# for hash characters at or above 8 and for address characters which are letters
+HASH_UPPER_MASK = bytes.maketrans(b"0123456789abcdef", b"\x00" * 8 + b"\x20" * 8)
+LETTER_UPPER_MASK = bytes(0x20 if char in b"abcdef" else 0x00 for char in range(256))
+
+def to_checksum_address(address: str | bytes) -> ChecksumAddress:
+    """Fast checksum address with caching. Accepts hex strings and raw 20 byte addresses."""
+    if not isinstance(address, str):
+        # raw bytes are hexed directly, which is already lower case and without prefix
+        assert len(address) == 20, "Address has incorrect length"
+        address = bytes(address).hex()
 
-    if normalized_address in CHECKSUM_CACHE:
-        return CHECKSUM_CACHE[normalized_address]
+    # keyed by the address as passed in, so cache hits skip the normalization
+    checksum_address = CHECKSUM_CACHE.get(address)
+    if checksum_address is not None:
+        return checksum_address
+
+    # slicing off the prefix instead of replace(), which would search the whole string
+    normalized_address = address[2:].lower() if address[:2] in ("0x", "0X") else address.lower()
+    assert len(normalized_address) == 40, "Address has incorrect length"
 
-    hashed_address = keccak(normalized_address.encode()).hex()
-    checksum_address = "0x" + "".join(
-        char.upper() if int(hashed_address[i], 16) >= 8 else char
-        for i, char in enumerate(normalized_address)
-    )
+    # flipping the case bit of all characters at once via big integers instead of a Python loop over the characters
+    address_bytes = normalized_address.encode()
+    hashed_address = keccak(address_bytes).hex()[:40].encode()
+    upper_mask = int.from_bytes(hashed_address.translate(HASH_UPPER_MASK), "big") & \
+        int.from_bytes(address_bytes.translate(LETTER_UPPER_MASK), "big")
+    checksum_address = "0x" + (int.from_bytes(address_bytes, "big") ^ upper_mask).to_bytes(40, "big").decode()
 
     if len(CHECKSUM_CACHE) >= CACHE_SIZE:
         CHECKSUM_CACHE.pop(next(iter(CHECKSUM_CACHE)))
 
-    CHECKSUM_CACHE[normalized_address] = checksum_address
+    CHECKSUM_CACHE[address] = checksum_address
     return cast(ChecksumAddress, checksum_address)
\ No newline at end of file
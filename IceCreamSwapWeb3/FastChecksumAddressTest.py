@@ -0,0 +1,42 @@
+import unittest
+from random import Random
+
+from eth_utils import to_checksum_address as eth_utils_to_checksum_address
+
+from .FastChecksumAddress import to_checksum_address
+
+
+class TestToChecksumAddress(unittest.TestCase):
+
+    def test_matches_eth_utils(self):
+        # fixed seed, so failures can be reproduced
+        random = Random(0)
+        for _ in range(1_000):
+            address_bytes = random.randbytes(20)
+            expected = eth_utils_to_checksum_address(address_bytes)
+            for address in (
+                address_bytes,
+                "0x" + address_bytes.hex(),
+                "0x" + address_bytes.hex().upper(),
+                "0X" + address_bytes.hex(),
+                address_bytes.hex(),
+                expected,
+            ):
+                self.assertEqual(to_checksum_address(address), expected)
+
+    def test_edge_cases(self):
+        for address_bytes in (bytes(20), b"\xff" * 20, bytes.fromhex("5aaeb6053f3e94c9b9a09f33669435e7ef1beaed")):
+            with self.subTest(address=address_bytes.hex()):
+                self.assertEqual(to_checksum_address("0x" + address_bytes.hex()), eth_utils_to_checksum_address(address_bytes))
+                self.assertEqual(to_checksum_address(address_bytes), eth_utils_to_checksum_address(address_bytes))
+                self.assertEqual(to_checksum_address(bytearray(address_bytes)), eth_utils_to_checksum_address(address_bytes))
+
+    def test_wrong_length(self):
+        for address in ("0x1234", "0x" + "12" * 21, "12" * 21, b"\x12" * 19):
+            with self.subTest(address=address):
+                with self.assertRaises(AssertionError):
+                    to_checksum_address(address)
+
+
+if __name__ == '__main__':
+    unittest.main()
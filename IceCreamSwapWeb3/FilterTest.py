@@ -1,14 +1,48 @@
 import unittest
+from functools import lru_cache, partial
+from itertools import chain
 from unittest.mock import MagicMock, patch
-from . import Web3Advanced
+from .EthAdvanced import EthAdvanced
+
+
+# mocked block hashes are this prefix followed by the block number
+MOCK_HASH_PREFIX = "hash_"
+
+
+def mock_hash_to_block_number(block_hash):
+    return int(block_hash[len(MOCK_HASH_PREFIX):])
+
+
+@lru_cache(maxsize=None)
+def mock_block(block_number):
+    # block bodies are built once per block number, get_logs does not modify them
+    block_hash = f"{MOCK_HASH_PREFIX}{block_number}"
+    parent_hash = f"{MOCK_HASH_PREFIX}{block_number - 1}" if block_number > 0 else None
+    return {'number': block_number, 'hash': block_hash, 'parentHash': parent_hash}
+
+
+def mock_get_logs(logs_storage, filter_params):
+    # shared by all tests, which bind their logs storage to it via functools.partial
+    if 'blockHash' in filter_params:
+        # Single block query
+        block_number = mock_hash_to_block_number(filter_params['blockHash'])
+        logs = logs_storage.get(block_number, [])
+        return logs
+    else:
+        from_block = filter_params.get('fromBlock', 0)
+        to_block = filter_params.get('toBlock', 0)
+        return list(chain.from_iterable(logs_storage.get(block_number, ()) for block_number in range(from_block, to_block + 1)))
 
 
 class TestWeb3AdvancedGetLogs(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        # Instantiate the class only once
-        cls.eth_advanced = Web3Advanced(node_url="https://rpc-core.icecreamswap.com").eth
+        # Instantiate the class only once, on a mocked Web3 instance so no RPC gets contacted
+        w3 = MagicMock()
+        w3.provider._is_batching = False
+        w3.manager.request_blocking.return_value = 1116  # chain id requested in the init
+        cls.eth_advanced = EthAdvanced(w3)
 
     def setUp(self):
         # Mock self.eth_advanced.w3 and its properties
@@ -16,6 +50,9 @@ class TestWeb3AdvancedGetLogs(unittest.TestCase):
         self.eth_advanced.w3.filter_block_range = 1000  # Set a default filter block range
         self.eth_advanced.w3.unstable_blocks = 10       # Set default unstable blocks
         self.eth_advanced.w3.latest_seen_block = 1000   # Set the latest seen block
+        self.eth_advanced.w3.max_parallel_requests = 4  # Set parallel requests used for splitting ranges
+        self.eth_advanced.w3.small_get_logs_threshold = 3  # Set ranges that are queried directly
+        self.eth_advanced.w3.use_logs_bloom = False  # Mocked blocks have no logs bloom
 
         # Mock get_block_number
         self.eth_advanced.get_block_number = MagicMock(return_value=1000)
@@ -31,28 +68,22 @@ class TestWeb3AdvancedGetLogs(unittest.TestCase):
                 block_number = None
             if block_number is None:
                 raise Exception(f"Invalid block identifier: {block_identifier}")
-            block_hash = f"hash_{block_number}"
-            parent_hash = f"hash_{block_number - 1}" if block_number > 0 else None
-            return {'number': block_number, 'hash': block_hash, 'parentHash': parent_hash}
+            return mock_block(block_number)
         self.eth_advanced.get_block = MagicMock(side_effect=mock_get_block)
 
         # Mock _get_logs
         self.logs_storage = {}  # To simulate storage of logs per block
-        def mock__get_logs(filter_params):
-            if 'blockHash' in filter_params:
-                # Single block query
-                block_number = int(filter_params['blockHash'].split('_')[1])
-                logs = self.logs_storage.get(block_number, [])
-                return logs
-            else:
-                from_block = filter_params.get('fromBlock', 0)
-                to_block = filter_params.get('toBlock', 0)
-                logs = []
-                for block_number in range(from_block, to_block + 1):
-                    block_logs = self.logs_storage.get(block_number, [])
-                    logs.extend(block_logs)
-                return logs
-        self.eth_advanced._get_logs = MagicMock(side_effect=mock__get_logs)
+        self.eth_advanced._get_logs = MagicMock(side_effect=partial(mock_get_logs, self.logs_storage))
+
+    def assertLogsCoverBlocks(self, logs, from_block, to_block):
+        # a single comparison covers duplicates, missing blocks and order. Only on a mismatch the cause is narrowed down
+        actual_block_numbers = [log['blockNumber'] for log in logs]
+        expected_block_numbers = list(range(from_block, to_block + 1))
+        if actual_block_numbers == expected_block_numbers:
+            return
+        self.assertEqual(len(actual_block_numbers), len(set(actual_block_numbers)), "Duplicate logs found")
+        self.assertEqual(sorted(actual_block_numbers), expected_block_numbers, "Missing or extra logs found")
+        self.assertEqual(actual_block_numbers, expected_block_numbers, "Logs are not in correct order")
 
     def test_get_logs_no_duplicates_no_missing_blocks_correct_order(self):
         # Prepare test data
@@ -67,14 +98,8 @@ class TestWeb3AdvancedGetLogs(unittest.TestCase):
         # Call get_logs
         logs = self.eth_advanced.get_logs(filter_params, use_subsquid=False)
 
-        # Collect block numbers from logs
-        actual_block_numbers = [log['blockNumber'] for log in logs]
-        expected_block_numbers = list(range(from_block, to_block + 1))
-
         # Assertions
-        self.assertEqual(len(actual_block_numbers), len(set(actual_block_numbers)), "Duplicate logs found")
-        self.assertEqual(sorted(actual_block_numbers), expected_block_numbers, "Missing or extra logs found")
-        self.assertEqual(actual_block_numbers, expected_block_numbers, "Logs are not in correct order")
+        self.assertLogsCoverBlocks(logs, from_block, to_block)
 
     def test_get_logs_range_exceeds_filter_block_range(self):
         # Adjust filter_block_range to force splitting
@@ -92,14 +117,8 @@ class TestWeb3AdvancedGetLogs(unittest.TestCase):
         # Call get_logs
         logs = self.eth_advanced.get_logs(filter_params, use_subsquid=False)
 
-        # Collect block numbers from logs
-        actual_block_numbers = [log['blockNumber'] for log in logs]
-        expected_block_numbers = list(range(from_block, to_block + 1))
-
         # Assertions
-        self.assertEqual(len(actual_block_numbers), len(set(actual_block_numbers)), "Duplicate logs found")
-        self.assertEqual(sorted(actual_block_numbers), expected_block_numbers, "Missing or extra logs found")
-        self.assertEqual(actual_block_numbers, expected_block_numbers, "Logs are not in correct order")
+        self.assertLogsCoverBlocks(logs, from_block, to_block)
 
     def test_get_logs_splits_on_error(self):
         # Prepare test data
@@ -116,23 +135,88 @@ class TestWeb3AdvancedGetLogs(unittest.TestCase):
             to_block = filter_params.get('toBlock', 0)
             if to_block - from_block + 1 > 10:
                 raise Exception("Simulated RPC error")
-            logs = []
-            for block_number in range(from_block, to_block + 1):
-                logs.extend(self.logs_storage.get(block_number, []))
-            return logs
+            return mock_get_logs(self.logs_storage, filter_params)
         self.eth_advanced._get_logs.side_effect = mock__get_logs
 
         # Call get_logs
         logs = self.eth_advanced.get_logs(filter_params, use_subsquid=False)
 
-        # Collect block numbers from logs
-        actual_block_numbers = [log['blockNumber'] for log in logs]
-        expected_block_numbers = list(range(from_block, to_block + 1))
+        # Assertions
+        self.assertLogsCoverBlocks(logs, from_block, to_block)
+
+    def test_get_logs_splits_on_error_with_hex_block_range(self):
+        # Prepare test data
+        from_block = 50
+        to_block = 100
+        filter_params = {'fromBlock': from_block, 'toBlock': to_block}
+
+        for block_number in range(from_block, to_block + 1):
+            self.logs_storage[block_number] = [{'blockNumber': block_number, 'logIndex': 0}]
+
+        # the hex block numbers in the error message contain "429", which must not be taken for rate limiting
+        def mock__get_logs(filter_params):
+            from_block = filter_params.get('fromBlock', 0)
+            to_block = filter_params.get('toBlock', 0)
+            if to_block - from_block + 1 > 10:
+                raise Exception("query exceeds limit. Try with this block range [0x1429AB, 0x1430FF]")
+            return mock_get_logs(self.logs_storage, filter_params)
+        self.eth_advanced._get_logs.side_effect = mock__get_logs
+
+        # Call get_logs
+        logs = self.eth_advanced.get_logs(filter_params, use_subsquid=False)
 
         # Assertions
-        self.assertEqual(len(actual_block_numbers), len(set(actual_block_numbers)), "Duplicate logs found")
-        self.assertEqual(sorted(actual_block_numbers), expected_block_numbers, "Missing or extra logs found")
-        self.assertEqual(actual_block_numbers, expected_block_numbers, "Logs are not in correct order")
+        self.assertLogsCoverBlocks(logs, from_block, to_block)
+        self.assertLess(self.eth_advanced._get_logs.call_count, 50, "Failing ranges were queried again instead of split")
+
+    @patch('IceCreamSwapWeb3.EthAdvanced.sleep')
+    def test_get_logs_splits_rate_limited_range_eventually(self, mock_sleep):
+        # Prepare test data
+        from_block = 50
+        to_block = 100
+        filter_params = {'fromBlock': from_block, 'toBlock': to_block}
+
+        for block_number in range(from_block, to_block + 1):
+            self.logs_storage[block_number] = [{'blockNumber': block_number, 'logIndex': 0}]
+
+        # a range which is always reported as rate limited is only queried again a limited number of times
+        def mock__get_logs(filter_params):
+            from_block = filter_params.get('fromBlock', 0)
+            to_block = filter_params.get('toBlock', 0)
+            if to_block - from_block + 1 > 10:
+                raise Exception("Too many requests")
+            return mock_get_logs(self.logs_storage, filter_params)
+        self.eth_advanced._get_logs.side_effect = mock__get_logs
+
+        # Call get_logs
+        logs = self.eth_advanced.get_logs(filter_params, use_subsquid=False)
+
+        # Assertions
+        self.assertLogsCoverBlocks(logs, from_block, to_block)
+
+    def test_get_logs_splits_small_range_on_error(self):
+        # Prepare test data, a range small enough to be queried directly
+        from_block = 50
+        to_block = 52
+        filter_params = {'fromBlock': from_block, 'toBlock': to_block}
+
+        for block_number in range(from_block, to_block + 1):
+            self.logs_storage[block_number] = [{'blockNumber': block_number, 'logIndex': 0}]
+
+        # a permanent error for more than a single block must lead to splitting, not to retrying
+        def mock__get_logs(filter_params):
+            from_block = filter_params.get('fromBlock', 0)
+            to_block = filter_params.get('toBlock', 0)
+            if to_block - from_block + 1 > 1:
+                raise Exception("response too large")
+            return mock_get_logs(self.logs_storage, filter_params)
+        self.eth_advanced._get_logs.side_effect = mock__get_logs
+
+        # Call get_logs
+        logs = self.eth_advanced.get_logs(filter_params, use_subsquid=False)
+
+        # Assertions
+        self.assertLogsCoverBlocks(logs, from_block, to_block)
 
     @patch('IceCreamSwapWeb3.EthAdvanced.get_filter')
     def test_get_logs_uses_subsquid(self, mock_get_filter):
@@ -156,14 +240,35 @@ class TestWeb3AdvancedGetLogs(unittest.TestCase):
         # Call get_logs with use_subsquid=True
         logs = self.eth_advanced.get_logs(filter_params, use_subsquid=True)
 
-        # Collect block numbers from logs
-        actual_block_numbers = [log['blockNumber'] for log in logs]
-        expected_block_numbers = list(range(from_block, to_block + 1))
+        # Assertions
+        self.assertLogsCoverBlocks(logs, from_block, to_block)
+
+    @patch('IceCreamSwapWeb3.EthAdvanced.get_filter')
+    def test_get_logs_resolves_latest_once(self, mock_get_filter):
+        # Make block 'latest' (1000) a stable block
+        self.eth_advanced.w3.latest_seen_block = 2000
+
+        # Prepare test data
+        from_block = 800
+        filter_params = {'fromBlock': from_block, 'toBlock': 'latest'}
+
+        for block_number in range(from_block, 1000 + 1):
+            self.logs_storage[block_number] = [{'blockNumber': block_number, 'logIndex': 0}]
+
+        # Simulate Subsquid only returning part of the logs, so the rest is requested from the RPC
+        def mock_get_filter_func(chain_id, filter_params, partial_allowed, p_bar):
+            till_block = 900
+            logs = [{'blockNumber': block_number, 'logIndex': 0} for block_number in range(from_block, till_block + 1)]
+            return till_block, logs
+        mock_get_filter.side_effect = mock_get_filter_func
+
+        # Call get_logs with use_subsquid=True
+        logs = self.eth_advanced.get_logs(filter_params, use_subsquid=True)
 
         # Assertions
-        self.assertEqual(len(actual_block_numbers), len(set(actual_block_numbers)), "Duplicate logs found")
-        self.assertEqual(sorted(actual_block_numbers), expected_block_numbers, "Missing or extra logs found")
-        self.assertEqual(actual_block_numbers, expected_block_numbers, "Logs are not in correct order")
+        latest_calls = [call for call in self.eth_advanced.get_block.call_args_list if call.args[:1] == ('latest',)]
+        self.assertEqual(len(latest_calls), 1, "Block 'latest' was resolved more than once")
+        self.assertEqual([log['blockNumber'] for log in logs], list(range(from_block, 1000 + 1)), "Missing or extra logs found")
 
     """
     def test_get_logs_unstable_blocks_handling(self):
@@ -190,9 +295,7 @@ class TestWeb3AdvancedGetLogs(unittest.TestCase):
                 block_number = None
             if block_number is None:
                 raise Exception(f"Invalid block identifier: {block_identifier}")
-            block_hash = f"hash_{block_number}"
-            parent_hash = f"hash_{block_number - 1}" if block_number > 0 else None
-            return {'number': block_number, 'hash': block_hash, 'parentHash': parent_hash}
+            return mock_block(block_number)
 
         self.eth_advanced.get_block.side_effect = mock_get_block
 
@@ -200,7 +303,7 @@ class TestWeb3AdvancedGetLogs(unittest.TestCase):
         def mock_get_logs_inner(filter_params, no_retry=False):
             block_hash = filter_params.get('blockHash')
             if block_hash:
-                block_number = int(block_hash.split('_')[1])
+                block_number = mock_hash_to_block_number(block_hash)
                 return self.logs_storage.get(block_number, [])
             else:
                 return []
@@ -210,14 +313,8 @@ class TestWeb3AdvancedGetLogs(unittest.TestCase):
         # Call get_logs
         logs = self.eth_advanced.get_logs(filter_params, use_subsquid=False)
 
-        # Collect block numbers from logs
-        actual_block_numbers = [log['blockNumber'] for log in logs]
-        expected_block_numbers = list(range(from_block, to_block + 1))
-
         # Assertions
-        self.assertEqual(len(actual_block_numbers), len(set(actual_block_numbers)), "Duplicate logs found")
-        self.assertEqual(sorted(actual_block_numbers), expected_block_numbers, "Missing or extra logs found")
-        self.assertEqual(actual_block_numbers, expected_block_numbers, "Logs are not in correct order")
+        self.assertLogsCoverBlocks(logs, from_block, to_block)
     """
 
 
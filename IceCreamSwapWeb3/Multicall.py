@@ -1,35 +1,112 @@
-import copy
+import json
+import os
+from collections import deque
+from functools import lru_cache
 from importlib.resources import files
-from typing import Optional
+from typing import Iterator, Optional
 
 import eth_abi
 import eth_utils
-import rlp
-from eth_utils import to_bytes
+from eth_abi.encoding import TupleEncoder
+from eth_abi.registry import registry as abi_registry
+from eth_utils import to_bytes, function_abi_to_4byte_selector
 from eth_utils.abi import get_abi_output_types, get_abi_input_types
-from web3.contract.contract import ContractFunction, ContractConstructor
+from web3.contract.contract import Contract, ContractFunction, ContractConstructor
 from web3.exceptions import ContractLogicError
 
 from IceCreamSwapWeb3 import Web3Advanced
 from .FastChecksumAddress import to_checksum_address
+from .Web3ErrorHandlerPatch import raise_contract_logic_error_on_revert
 
-# load multicall abi
-with files("IceCreamSwapWeb3").joinpath("./abi/Multicall.abi").open('r') as f:
-    MULTICALL_ABI = f.read()
 
-# load undeployed multicall abi and bytecode
-with files("IceCreamSwapWeb3").joinpath("./abi/UndeployedMulticall.abi").open('r') as f:
-    UNDEPLOYED_MULTICALL_ABI = f.read()
-with files("IceCreamSwapWeb3").joinpath("./bytecode/UndeployedMulticall.bytecode").open('r') as f:
-    UNDEPLOYED_MULTICALL_BYTECODE = f.read()
+# ABIs and bytecodes are loaded on first use instead of at import time
+@lru_cache(maxsize=None)
+def _load_resource(name: str) -> str:
+    return files("IceCreamSwapWeb3").joinpath(name).read_text()
+
+
+@lru_cache(maxsize=None)
+def _load_abi(name: str) -> list[dict]:
+    # parsed once, so contracts don't parse the ABI again and their functions share the same ABI dicts
+    return json.loads(_load_resource(name))
+
+
+# module level constants kept for backwards compatibility, loaded lazily
+_LAZY_RESOURCES = {
+    "MULTICALL_ABI": "./abi/Multicall.abi",
+    "UNDEPLOYED_MULTICALL_ABI": "./abi/UndeployedMulticall.abi",
+    "UNDEPLOYED_MULTICALL_BYTECODE": "./bytecode/UndeployedMulticall.bytecode",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_RESOURCES:
+        return _load_resource(_LAZY_RESOURCES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # allowed chars in HEX string
 HEX_CHARS = set("0123456789abcdef")
 
+# parsed ABI input and output types per function ABI. ABI dicts are not hashable, but all calls to the same
+# contract function share the same dict, so they are keyed by id. The ABI itself is kept in the cached value,
+# so its id can not be reused by another object while cached
+ABI_TYPES_CACHE_SIZE = int(os.getenv("ABI_TYPES_CACHE_SIZE", 1000))
+ABI_INPUT_TYPES_CACHE: dict[int, tuple[dict, list[str]]] = {}
+ABI_OUTPUT_TYPES_CACHE: dict[int, tuple[dict, list[str]]] = {}
+ABI_INPUT_ENCODER_CACHE: dict[int, tuple[dict, TupleEncoder]] = {}
+
+
+def _cached_abi_types(cache: dict[int, tuple[dict, list[str]]], abi: dict, get_types) -> list[str]:
+    cached = cache.get(id(abi))
+    if cached is None or cached[0] is not abi:
+        if len(cache) >= ABI_TYPES_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+        cached = cache[id(abi)] = (abi, get_types(abi))
+    return cached[1]
+
+
+def _cached_abi_input_types(abi: dict) -> list[str]:
+    return _cached_abi_types(ABI_INPUT_TYPES_CACHE, abi, get_abi_input_types)
+
+
+def _cached_abi_output_types(abi: dict) -> list[str]:
+    return _cached_abi_types(ABI_OUTPUT_TYPES_CACHE, abi, get_abi_output_types)
+
+
+def _cached_abi_input_encoder(abi: dict) -> TupleEncoder:
+    # same as eth_abi.encode(input_types, args), without looking up and validating the types again for every call
+    return _cached_abi_types(
+        ABI_INPUT_ENCODER_CACHE,
+        abi,
+        lambda function_abi: abi_registry.get_tuple_encoder(*_cached_abi_input_types(function_abi))
+    )
+
+
+@lru_cache(maxsize=None)
+def _multicall_function_encoding() -> tuple[bytes, TupleEncoder, list[str]]:
+    # selector, input encoder and output types of multicallWithGasLimitation, to en- and decode calls without a ContractFunction
+    function_abi = next(abi for abi in _load_abi("./abi/Multicall.abi") if abi.get("name") == "multicallWithGasLimitation")
+    return (
+        function_abi_to_4byte_selector(function_abi),
+        abi_registry.get_tuple_encoder(*get_abi_input_types(function_abi)),
+        get_abi_output_types(function_abi)
+    )
+
+
+@lru_cache(maxsize=1024)
+def _selector_bytes(selector: str) -> bytes:
+    # selectors are always "0x" followed by 4 hex encoded bytes, so no need for the validation of to_bytes
+    return bytes.fromhex(selector[2:])
+
 
 class MultiCall:
     CALLER_ADDRESS = "0x0000000000000000000000000000000000000123"
+    # gas limit per call and gas kept back by the deployed multicall to return the results
+    CALL_GAS_LIMIT = 100_000_000
+    GAS_BUFFER = 1_000_000
 
+    # checksummed addresses, so they can be used as is. Add new ones via register_multicall_contract
     MULTICALL_DEPLOYMENTS: dict[int, str] = {
         1116: "0x66BF74f6Afe41fd10a5343B39Dae017EF9CceF1b",
         245022934: "0x8179Cb0771B8CAA1ef412266e9faCe0C8d05E4Db",
@@ -44,24 +121,40 @@ class MultiCall:
 
     def __init__(
             self,
-            w3: Web3Advanced
+            w3: Web3Advanced,
+            dedupe_reads: bool = False,  # execute identical calls only once. Only safe if calls don't change state
     ):
         self.w3 = w3
         self.chain_id = self.w3.eth.chain_id
+        self.dedupe_reads = dedupe_reads
 
-        if self.chain_id in self.MULTICALL_DEPLOYMENTS:
-            self.multicall = self.w3.eth.contract(
-                abi=MULTICALL_ABI,
-                address=to_checksum_address(self.MULTICALL_DEPLOYMENTS[self.chain_id])
-            )
+        multicall_address = self.MULTICALL_DEPLOYMENTS.get(self.chain_id)
+        self.multicall = self._get_multicall_contract(multicall_address)
+        if multicall_address is not None:
             self.undeployed_contract_address = self.calculate_create_address(sender=self.multicall.address, nonce=1)
         else:
-            self.multicall = self.w3.eth.contract(abi=UNDEPLOYED_MULTICALL_ABI, bytecode=UNDEPLOYED_MULTICALL_BYTECODE)
             self.undeployed_contract_address = self.calculate_expected_contract_address(sender=self.CALLER_ADDRESS, nonce=0)
 
         self.calls: list[ContractFunction] = []
+        # indexes of the calls which go to the undeployed contract, instead of copying the function to change its address.
+        # Recorded when adding the call, so calls appended to self.calls directly are regular calls wherever they are
+        self._undeployed_call_indexes: set[int] = set()
         self.undeployed_contract_constructor: Optional[ContractConstructor] = None
 
+    def _get_multicall_contract(self, multicall_address: Optional[str]) -> Contract | type[Contract]:
+        # contracts are reused for all multicalls of a w3 instance. The chain is fixed per w3, so the address is enough
+        multicall = self.w3.multicall_contracts.get(multicall_address)
+        if multicall is None:
+            if multicall_address is not None:
+                multicall = self.w3.eth.contract(abi=_load_abi("./abi/Multicall.abi"), address=multicall_address)
+            else:
+                multicall = self.w3.eth.contract(
+                    abi=_load_abi("./abi/UndeployedMulticall.abi"),
+                    bytecode=_load_resource("./bytecode/UndeployedMulticall.bytecode")
+                )
+            self.w3.multicall_contracts[multicall_address] = multicall
+        return multicall
+
     def add_call(self, contract_func: ContractFunction):
         self.calls.append(contract_func)
 
@@ -71,93 +164,181 @@ class MultiCall:
 
     def add_undeployed_contract_call(self, contract_func: ContractFunction):
         assert self.undeployed_contract_constructor is not None, "No undeployed contract added yet"
-        contract_func = copy.copy(contract_func)
-        contract_func.address = 0  # self.undeployed_contract_address
+        self._undeployed_call_indexes.add(len(self.calls))
         self.calls.append(contract_func)
 
-    def call(self, use_revert: Optional[bool] = None, batch_size: int = 1_000):
-        results, _ = self.call_with_gas(use_revert=use_revert, batch_size=batch_size)
+    def call(self, use_revert: Optional[bool] = None, batch_size: int = 1_000, batched: bool = False):
+        results, _ = self.call_with_gas(use_revert=use_revert, batch_size=batch_size, batched=batched)
         return results
 
-    def call_with_gas(self, use_revert: Optional[bool] = None, batch_size: int = 1_000):
+    def call_with_gas(self, use_revert: Optional[bool] = None, batch_size: int = 1_000, batched: bool = False):
+        # results are written at the index of their call, so no partial result lists get concatenated
+        results: list[Exception | tuple[any, ...]] = [None] * len(self.calls)
+        gas_usages: list[int] = [None] * len(self.calls)
+        for index, result, gas_usage in self.iter_call_with_gas(use_revert=use_revert, batch_size=batch_size, batched=batched):
+            results[index] = result
+            gas_usages[index] = gas_usage
+        return results, gas_usages
+
+    def iter_call_with_gas(
+            self,
+            use_revert: Optional[bool] = None,
+            batch_size: int = 1_000,
+            batched: bool = False
+    ) -> Iterator[tuple[int, Exception | tuple[any, ...], Optional[int]]]:
+        # yields (call index, result, gas usage) as soon as the batch of a call got executed, so the results of huge
+        # numbers of calls don't need to be held in memory. Ascending by index, unless batched or deduplicated
         if use_revert is None:
             use_revert = self.w3.revert_reason_available
 
-        calls = self.calls
-        calls_with_calldata = self.add_calls_calldata(calls)
+        # batched sends the eth_calls of all multicall batches as one JSON-RPC batch request, if the RPC supports it
+        batched = batched and self.w3.rpc_batch_max_size > 1
 
-        return self._inner_call(use_revert=use_revert, calls_with_calldata=calls_with_calldata, batch_size=batch_size)
+        if batched or self.dedupe_reads:
+            # all calls are needed at once, to send all batches together or to find identical calls
+            chunk_size = max(len(self.calls), 1)
+        else:
+            # calls are encoded chunk by chunk, so only the calldata of the currently executed calls is in memory
+            chunk_size = batch_size
+
+        for chunk_start in range(0, len(self.calls), chunk_size):
+            chunk_end = min(chunk_start + chunk_size, len(self.calls))
+            undeployed_flags = [index in self._undeployed_call_indexes for index in range(chunk_start, chunk_end)]
+            calls_with_calldata = self._add_calls_calldata(self.calls[chunk_start:chunk_end], undeployed_flags)
+
+            call_indexes_per_unique_call: Optional[list[list[int]]] = None
+            if self.dedupe_reads:
+                calls_with_calldata, unique_call_indexes = self._dedupe_calls(calls_with_calldata)
+                call_indexes_per_unique_call = [[] for _ in calls_with_calldata]
+                for call_index, unique_call_index in enumerate(unique_call_indexes):
+                    call_indexes_per_unique_call[unique_call_index].append(call_index)
+
+            for start, batch_results, batch_gas_usages in self._iter_inner_call(
+                    use_revert=use_revert,
+                    calls_with_calldata=calls_with_calldata,
+                    batch_size=batch_size,
+                    batched=batched
+            ):
+                for index, (result, gas_usage) in enumerate(zip(batch_results, batch_gas_usages), start):
+                    if call_indexes_per_unique_call is None:
+                        yield chunk_start + index, result, gas_usage
+                    else:
+                        # fan the result of the executed call out to all identical calls
+                        for call_index in call_indexes_per_unique_call[index]:
+                            yield chunk_start + call_index, result, gas_usage
 
-    def _inner_call(
+    @staticmethod
+    def _dedupe_calls(
+            calls_with_calldata: list[tuple[ContractFunction, bytes, bool]]
+    ) -> tuple[list[tuple[ContractFunction, bytes, bool]], list[int]]:
+        # returns the unique calls and for each call the index of its unique call
+        unique_calls: list[tuple[ContractFunction, bytes, bool]] = []
+        unique_call_indexes: list[int] = []
+        unique_call_index_by_key: dict[tuple[str, bytes], int] = {}
+        for call_with_calldata in calls_with_calldata:
+            call, call_data, is_undeployed = call_with_calldata
+            if is_undeployed:
+                # calls to the undeployed contract are never deduplicated, they are often setters followed by getters
+                unique_call_indexes.append(len(unique_calls))
+                unique_calls.append(call_with_calldata)
+                continue
+            key = (call.address, call_data)
+            unique_call_index = unique_call_index_by_key.get(key)
+            if unique_call_index is None:
+                unique_call_index = unique_call_index_by_key[key] = len(unique_calls)
+                unique_calls.append(call_with_calldata)
+            unique_call_indexes.append(unique_call_index)
+        return unique_calls, unique_call_indexes
+
+    def _iter_inner_call(
             self,
             use_revert: bool,
-            calls_with_calldata: list[tuple[ContractFunction, bytes]],
-            batch_size: int
-    ) -> tuple[list[Exception | tuple[any, ...]], list[int]]:
-        if len(calls_with_calldata) == 0:
-            return [], []
-        kwargs = dict(
-            use_revert=use_revert,
-            batch_size=batch_size,
-        )
-        # make sure calls are not bigger than batch_size
-        if len(calls_with_calldata) > batch_size:
-            results_combined = []
-            gas_usages_combined = []
-            for start in range(0, len(calls_with_calldata), batch_size):
-                results, gas_usages = self._inner_call(
-                    **kwargs,
-                    calls_with_calldata=calls_with_calldata[start: min(start + batch_size, len(calls_with_calldata))],
-                )
-                results_combined += results
-                gas_usages_combined += gas_usages
-            return results_combined, gas_usages_combined
-
-        if self.multicall.address is None:
-            multicall_call = self._build_constructor_calldata(
-                calls_with_calldata=calls_with_calldata,
-                use_revert=use_revert
-            )
-        else:
-            multicall_call = self._build_calldata(
-                calls_with_calldata=calls_with_calldata
-            )
-            use_revert = False
+            calls_with_calldata: list[tuple[ContractFunction, bytes, bool]],
+            batch_size: int,
+            batched: bool = False
+    ) -> Iterator[tuple[int, list[Exception | tuple[any, ...]], list[Optional[int]]]]:
+        # ranges of calls still to execute are processed from a work queue instead of recursively.
+        # yields the index of the first call, the results and the gas usages of every executed range
 
-        try:
-            raw_returns, gas_usages = self._call_multicall(
-                multicall_call=multicall_call,
-                use_revert=use_revert,
-                retry=False
-            )
-        except Exception as e:
-            if len(calls_with_calldata) == 1:
-                try:
-                    raw_returns, gas_usages = self._call_multicall(
-                        multicall_call=multicall_call,
-                        use_revert=use_revert,
-                        retry=True
-                    )
-                except Exception as e:
-                    raw_returns = [e]
-                    gas_usages = [None]
+        # make sure calls are not bigger than batch_size
+        pending: deque[tuple[int, int]] = deque(
+            (start, min(start + batch_size, len(calls_with_calldata)))
+            for start in range(0, len(calls_with_calldata), batch_size)
+        )
+        # the deployed multicall takes (target, gasLimit, callData) tuples. They are built once for all calls,
+        # so split batches and remainders of partially executed batches only slice them
+        encoded_calls: list[tuple[str, int, bytes]] = []
+        deployment_encoded_call: Optional[tuple[str, int, bytes]] = None
+        if self.multicall.address is not None:
+            encoded_calls = self._encode_calls(calls_with_calldata)
+            if self.undeployed_contract_constructor is not None:
+                deployment_encoded_call = self._encode_deployment_call()
+
+        while pending:
+            # sequentially one range after the other, batched all pending ranges in one round trip
+            ranges = list(pending) if batched else [pending.popleft()]
+            if batched:
+                pending.clear()
+
+            batch_use_revert = use_revert and self.multicall.address is None
+            multicall_calls = [
+                self._build_calldata(encoded_calls=encoded_calls[start:end], deployment_encoded_call=deployment_encoded_call)
+                if self.multicall.address is not None else
+                self._build_constructor_calldata(calls_with_calldata=calls_with_calldata[start:end], use_revert=use_revert)
+                for start, end in ranges
+            ]
+            if batched and len(multicall_calls) > 1:
+                multicall_results = self._call_multicalls_batched(multicall_calls=multicall_calls, use_revert=batch_use_revert)
             else:
-                left_results, left_gas_usages = self._inner_call(**kwargs, calls_with_calldata=calls_with_calldata[:len(calls_with_calldata) // 2])
-                right_results, right_gas_usages = self._inner_call(**kwargs, calls_with_calldata=calls_with_calldata[len(calls_with_calldata) // 2:])
-                return left_results + right_results, left_gas_usages + right_gas_usages
-        else:
-            if len(raw_returns) != len(calls_with_calldata) and len(raw_returns) > 1:
-                # multicall stopped in the middle due to running out of gas.
-                # better remove the last result.
-                raw_returns = raw_returns[:-1]
-                gas_usages = gas_usages[:-1]
-        assert len(raw_returns) == len(gas_usages)
-        results = self.decode_contract_function_results(raw_returns=raw_returns, contract_functions=[call for call, _ in calls_with_calldata])
-        if len(results) == len(calls_with_calldata):
-            return results, gas_usages
-        # if not all calls were executed, recursively execute remaining calls and concatenate results
-        right_results, right_gas_usages = self._inner_call(**kwargs, calls_with_calldata=calls_with_calldata[len(results):])
-        return results + right_results, gas_usages + right_gas_usages
+                multicall_results = []
+                for multicall_call in multicall_calls:
+                    try:
+                        multicall_results.append(self._call_multicall(
+                            multicall_call=multicall_call,
+                            use_revert=batch_use_revert,
+                            retry=False
+                        ))
+                    except Exception as e:
+                        multicall_results.append(e)
+
+            # ranges to execute next, in order. Pushed to the front, so sequential execution is depth first
+            next_ranges: list[tuple[int, int]] = []
+            for (start, end), multicall_call, multicall_result in zip(ranges, multicall_calls, multicall_results):
+                batch = calls_with_calldata[start:end]
+                if not isinstance(multicall_result, Exception) and len(multicall_result[0]) == 0:
+                    # would otherwise queue the same calls again forever
+                    multicall_result = ValueError("Multicall did not execute any call")
+                if isinstance(multicall_result, Exception):
+                    if len(batch) == 1:
+                        try:
+                            raw_returns, batch_gas_usages = self._call_multicall(
+                                multicall_call=multicall_call,
+                                use_revert=batch_use_revert,
+                                retry=True
+                            )
+                        except Exception as e:
+                            raw_returns = [e]
+                            batch_gas_usages = [None]
+                    else:
+                        # execute both halves next, the left one first
+                        middle = start + len(batch) // 2
+                        next_ranges += [(start, middle), (middle, end)]
+                        continue
+                else:
+                    raw_returns, batch_gas_usages = multicall_result
+                    if len(raw_returns) != len(batch) and len(raw_returns) > 1:
+                        # multicall stopped in the middle due to running out of gas.
+                        # better remove the last result.
+                        raw_returns = raw_returns[:-1]
+                        batch_gas_usages = batch_gas_usages[:-1]
+                assert len(raw_returns) == len(batch_gas_usages)
+                batch_results = self.decode_contract_function_results(raw_returns=raw_returns, contract_functions=[call for call, _, _ in batch])
+                executed_end = start + len(batch_results)
+                yield start, batch_results, batch_gas_usages[:len(batch_results)]
+                if executed_end < end:
+                    # if not all calls were executed, execute the remaining calls next
+                    next_ranges.append((executed_end, end))
+            pending.extendleft(reversed(next_ranges))
 
     @staticmethod
     def calculate_expected_contract_address(sender: str, nonce: int):
@@ -166,76 +347,114 @@ class MultiCall:
         return contract_address
 
     @staticmethod
+    @lru_cache(maxsize=1024)
     def calculate_create_address(sender: str, nonce: int) -> str:
         assert len(sender) == 42
         sender_bytes = to_bytes(hexstr=sender)
-        raw = rlp.encode([sender_bytes, nonce])
+        # RLP encoding of [sender, nonce] done by hand, as the layout is always a 20 byte string and an integer
+        if nonce == 0:
+            nonce_encoded = b"\x80"
+        elif nonce < 0x80:
+            nonce_encoded = bytes([nonce])
+        else:
+            nonce_length = (nonce.bit_length() + 7) // 8
+            nonce_encoded = bytes([0x80 + nonce_length]) + nonce.to_bytes(nonce_length, "big")
+        payload = b"\x94" + sender_bytes + nonce_encoded
+        raw = bytes([0xc0 + len(payload)]) + payload
         h = eth_utils.keccak(raw)
         address_bytes = h[12:]
-        return eth_utils.to_checksum_address(address_bytes)
+        return to_checksum_address(address_bytes)
 
     @staticmethod
     def add_calls_calldata(calls: list[ContractFunction]) -> list[tuple[ContractFunction, bytes]]:
+        return [
+            (call, call_data)
+            for call, call_data, _ in MultiCall._add_calls_calldata(calls, [False] * len(calls))
+        ]
+
+    @staticmethod
+    def _add_calls_calldata(
+            calls: list[ContractFunction],
+            undeployed_flags: list[bool]
+    ) -> list[tuple[ContractFunction, bytes, bool]]:
+        assert len(undeployed_flags) == len(calls)
         calls_with_calldata = []
-        for call in calls:
-            function_abi = get_abi_input_types(call.abi)
-            assert len(function_abi) == len(call.arguments)
-            function_args = []
-            for aby_type, arg in zip(function_abi, call.arguments):
-                if aby_type == "bytes":
-                    arg = to_bytes(hexstr=arg)
-                function_args.append(arg)
-            call_data = to_bytes(hexstr=call.selector) + eth_abi.encode(function_abi, function_args)
-            calls_with_calldata.append((call, call_data))
+        append_call = calls_with_calldata.append
+        for call, is_undeployed in zip(calls, undeployed_flags):
+            function_abi = _cached_abi_input_types(call.abi)
+            function_args = call.arguments
+            assert len(function_abi) == len(function_args)
+            if len(function_abi) == 0:
+                # calls without arguments, like most getters, are just the selector
+                append_call((call, _selector_bytes(call.selector), is_undeployed))
+                continue
+            if "bytes" in function_abi:
+                function_args = [
+                    to_bytes(hexstr=arg) if aby_type == "bytes" and isinstance(arg, str) else arg
+                    for aby_type, arg in zip(function_abi, function_args)
+                ]
+            call_data = _selector_bytes(call.selector) + _cached_abi_input_encoder(call.abi)(function_args)
+            append_call((call, call_data, is_undeployed))
         assert len(calls_with_calldata) == len(calls)
         return calls_with_calldata
 
-    def _build_calldata(self, calls_with_calldata: list[tuple[ContractFunction, bytes]]) -> ContractFunction:
+    def _encode_calls(self, calls_with_calldata: list[tuple[ContractFunction, bytes, bool]]) -> list[tuple[str, int, bytes]]:
+        undeployed_contract_address = self.undeployed_contract_address
+        call_gas_limit = self.CALL_GAS_LIMIT
+        return [
+            # target, gasLimit, callData
+            (undeployed_contract_address if is_undeployed else call.address, call_gas_limit, call_data)
+            for call, call_data, is_undeployed in calls_with_calldata
+        ]
+
+    def _encode_deployment_call(self) -> tuple[str, int, bytes]:
+        # deploys the undeployed contract, so the other calls can call it
+        contract_deployment_call = self.multicall.functions.deployContract(
+            contractBytecode=to_bytes(hexstr=self.undeployed_contract_constructor.data_in_transaction)
+        )
+        contract_deployment_calldata = _selector_bytes(contract_deployment_call.selector) + \
+                                       eth_abi.encode(
+                                           _cached_abi_input_types(contract_deployment_call.abi),
+                                           contract_deployment_call.arguments
+                                       )
+        # contract_deployment_calldata = to_bytes(hexstr=contract_deployment_call._encode_transaction_data())
+        return contract_deployment_call.address, self.CALL_GAS_LIMIT, contract_deployment_calldata
+
+    def _build_calldata(
+            self,
+            encoded_calls: list[tuple[str, int, bytes]],
+            deployment_encoded_call: Optional[tuple[str, int, bytes]] = None
+    ) -> bytes:
         assert self.multicall.address is not None
 
-        if self.undeployed_contract_constructor is not None:
+        if deployment_encoded_call is not None:
             # deploy undeployed contract first and then call the other functions
-            contract_deployment_call = self.multicall.functions.deployContract(
-                contractBytecode=to_bytes(hexstr=self.undeployed_contract_constructor.data_in_transaction)
-            )
-            contract_deployment_calldata = to_bytes(hexstr=contract_deployment_call.selector) + \
-                                           eth_abi.encode(
-                                               get_abi_input_types(contract_deployment_call.abi),
-                                               contract_deployment_call.arguments
-                                           )
-            # contract_deployment_calldata = to_bytes(hexstr=contract_deployment_call._encode_transaction_data())
-            calls_with_calldata = [(contract_deployment_call, contract_deployment_calldata)] + calls_with_calldata
-
-        encoded_calls = []
-        for call, call_data in calls_with_calldata:
-            to_address = call.address if call.address != 0 else self.undeployed_contract_address
-            encoded_calls.append((to_address, 100_000_000, call_data))  # target, gasLimit, callData
-
-        # build multicall transaction
-        multicall_call = self.multicall.functions.multicallWithGasLimitation(
-            calls=encoded_calls,
-            gasBuffer=1_000_000,
-        )
+            encoded_calls = [deployment_encoded_call] + encoded_calls
 
-        # return multicall address and calldata
-        return multicall_call
+        # manually encoding the multicall calldata because web3.py is sooooo slow...
+        # The simple but slow version is as below:
+        # multicall_call = self.multicall.functions.multicallWithGasLimitation(calls=encoded_calls, gasBuffer=self.GAS_BUFFER)
+        # _, multicall_result, completed_calls = multicall_call.call({"from": self.CALLER_ADDRESS, "nonce": 0})
+        selector, input_encoder, _ = _multicall_function_encoding()
+        return selector + input_encoder((encoded_calls, self.GAS_BUFFER))
 
     def _build_constructor_calldata(
             self,
-            calls_with_calldata: list[tuple[ContractFunction, bytes]],
+            calls_with_calldata: list[tuple[ContractFunction, bytes, bool]],
             use_revert: bool
     ) -> ContractConstructor:
         assert self.multicall.address is None
 
-        # Encode the number of calls as the first 32 bytes
+        # Encode the number of calls as the first 32 bytes.
+        # raw bytes are appended to a bytearray, instead of concatenating ABI encoded values as hex strings
         number_of_calls = len(calls_with_calldata)
-        encoded_calls = eth_abi.encode(['uint256'], [number_of_calls]).hex()
+        encoded_calls = bytearray(number_of_calls.to_bytes(32, "big"))
 
         previous_target = None
         previous_call_data = None
 
-        for call, call_data in calls_with_calldata:
-            target = call.address if call.address != 0 else "0x0000000000000000000000000000000000000000"
+        for call, call_data, is_undeployed in calls_with_calldata:
+            target = "0x0000000000000000000000000000000000000000" if is_undeployed else call.address
 
             # Determine the flags
             flags = 0
@@ -245,24 +464,17 @@ class MultiCall:
                 flags |= 2  # Set bit 1 if calldata is the same as previous
 
             # Encode the flag byte (1 byte)
-            flags_encoded = format(flags, '02x')
+            encoded_calls.append(flags)
 
             if flags & 1 == 0:  # If target is different
-                # Encode target address (20 bytes, padded to 32 bytes)
-                target_encoded = eth_abi.encode(['address'], [target]).hex()[24:]  # remove leading zeros
-            else:
-                target_encoded = ""
+                # Encode target address (20 bytes)
+                encoded_calls += bytes.fromhex(target[2:])
 
             if flags & 2 == 0:  # If calldata is different
                 # Encode call data length (16 bits / 2 bytes)
-                call_data_length_encoded = eth_abi.encode(['uint16'], [len(call_data)]).hex().zfill(4)[-4:]
+                encoded_calls += len(call_data).to_bytes(2, "big")
                 # Encode call data (variable length)
-                call_data_encoded = call_data.hex()
-            else:
-                call_data_length_encoded = ""
-                call_data_encoded = ""
-
-            encoded_calls += flags_encoded + target_encoded + call_data_length_encoded + call_data_encoded
+                encoded_calls += call_data
 
             # Update previous values
             previous_target = target
@@ -275,7 +487,7 @@ class MultiCall:
         multicall_call = self.multicall.constructor(
             useRevert=use_revert,
             contractBytecode=contract_constructor_data,
-            encodedCalls=to_bytes(hexstr=encoded_calls)
+            encodedCalls=bytes(encoded_calls)
         )
 
         return multicall_call
@@ -298,22 +510,22 @@ class MultiCall:
             return raw_returns, gas_usages
 
         # undeployed multicall
-        # decode returned data into segments
-        multicall_result_copy = multicall_result[:]
-        raw_returns_encoded = []
-        while len(multicall_result_copy) != 0:
-            data_len = int.from_bytes(multicall_result_copy[:2], byteorder='big')
-            raw_returns_encoded.append(multicall_result_copy[2:data_len])
-            multicall_result_copy = multicall_result_copy[data_len:]
-
-        # decode returned data for each call
-        for raw_return_encoded in raw_returns_encoded:
+        # decode returned data segment by segment in a single pass. Walking a memoryview by offset,
+        # so only the return data of each call gets copied
+        multicall_result_view = memoryview(multicall_result)
+        multicall_result_len = len(multicall_result_view)
+        offset = 0
+        while offset < multicall_result_len:
+            # segment length including its 2 byte length prefix
+            data_len = (multicall_result_view[offset] << 8) | multicall_result_view[offset + 1]
+            raw_return_encoded = multicall_result_view[offset + 2:offset + data_len]
+            offset += data_len
             try:
                 # we are using packed encoding to decrease size of return data, if not we could have used
                 # success, raw_return = eth_abi.decode(['bool', 'bytes'], raw_return_encoded)
                 success = raw_return_encoded[0] == 1
-                gas_usage = int(raw_return_encoded[1:5].hex(), 16)
-                raw_return = raw_return_encoded[5:]
+                gas_usage = int.from_bytes(raw_return_encoded[1:5], "big")
+                raw_return = bytes(raw_return_encoded[5:])
                 if not success:
                     decoded = MultiCall.get_revert_reason(raw_return)
                     raw_return = ContractLogicError(f"execution reverted: {decoded}")
@@ -336,41 +548,113 @@ class MultiCall:
             except Exception:
                 return revert_bytes
 
+    def _multicall_transaction(self, multicall_call: ContractConstructor | bytes) -> dict:
+        if isinstance(multicall_call, ContractConstructor):
+            return {
+                "from": self.CALLER_ADDRESS,
+                "nonce": 0,
+                "data": multicall_call.data_in_transaction,
+            }
+        # calldata for the deployed multicall
+        return {
+            "from": self.CALLER_ADDRESS,
+            "to": self.multicall.address,
+            "nonce": 0,
+            "data": multicall_call,
+        }
+
     def _call_multicall(
             self,
-            multicall_call: ContractConstructor | ContractFunction,
+            multicall_call: ContractConstructor | bytes,
             use_revert: bool,
             retry: bool = False
     ):
         # call transaction
         try:
+            raw_response = self.w3.eth.call({
+                **self._multicall_transaction(multicall_call),
+                "no_retry": not retry,
+            })
+        except ContractLogicError as e:
+            raw_response = e
+        return self._decode_multicall_response(multicall_call, raw_response, use_revert)
+
+    def _call_multicalls_batched(
+            self,
+            multicall_calls: list[ContractConstructor | bytes],
+            use_revert: bool
+    ) -> list[tuple[list[bytes | Exception], list[int]] | Exception]:
+        # the eth_calls are sent to the provider directly. The BatchRetryMiddleware would retry reverting
+        # calls forever, but with use_revert the multicall always reverts and failing batches get split anyway
+        block_identifier = self.w3.eth.default_block
+        if isinstance(block_identifier, int):
+            # web3 allows an integer default block, the RPC expects it hex encoded
+            block_identifier = hex(block_identifier)
+        requests = []
+        for multicall_call in multicall_calls:
+            transaction = self._multicall_transaction(multicall_call)
+            transaction["nonce"] = "0x0"
+            if not isinstance(transaction["data"], str):
+                transaction["data"] = "0x" + transaction["data"].hex()
+            requests.append(("eth_call", [transaction, block_identifier]))
+
+        multicall_results = []
+        batch_max_size = self.w3.rpc_batch_max_size
+        for chunk_start in range(0, len(requests), batch_max_size):
+            requests_chunk = requests[chunk_start:chunk_start + batch_max_size]
+            multicall_calls_chunk = multicall_calls[chunk_start:chunk_start + batch_max_size]
+            try:
+                responses = self.w3.provider.make_batch_request(requests_chunk)
+            except Exception as e:
+                responses = e
+            if not isinstance(responses, list) or len(responses) != len(requests_chunk):
+                print(f"batched multicall with {len(requests_chunk)} requests failed with {repr(responses)}, calling them one by one")
+                for multicall_call in multicall_calls_chunk:
+                    try:
+                        multicall_results.append(self._call_multicall(multicall_call, use_revert=use_revert, retry=False))
+                    except Exception as e:
+                        multicall_results.append(e)
+                continue
+
+            for multicall_call, (_, params), response in zip(multicall_calls_chunk, requests_chunk, responses):
+                try:
+                    try:
+                        raw_response = self.w3.manager.formatted_response(
+                            response,
+                            params,
+                            error_formatters=raise_contract_logic_error_on_revert
+                        )
+                        raw_response = to_bytes(hexstr=raw_response)
+                    except ContractLogicError as e:
+                        raw_response = e
+                    multicall_results.append(self._decode_multicall_response(multicall_call, raw_response, use_revert))
+                except Exception as e:
+                    multicall_results.append(e)
+        return multicall_results
+
+    def _decode_multicall_response(
+            self,
+            multicall_call: ContractConstructor | bytes,
+            raw_response: bytes | ContractLogicError,
+            use_revert: bool
+    ):
+        if isinstance(raw_response, ContractLogicError):
+            e = raw_response
+            if not use_revert:
+                raise e
+            if not e.message.startswith("execution reverted: "):
+                raise e
+            result_str = e.message.removeprefix("execution reverted: ")
+            if any((char not in HEX_CHARS for char in result_str)):
+                raise e
+            multicall_result = to_bytes(hexstr=result_str)
+        else:
+            if use_revert:
+                raise ValueError("Multicall did not revert but was expected to")
             if isinstance(multicall_call, ContractConstructor):
-                multicall_result = self.w3.eth.call({
-                    "from": self.CALLER_ADDRESS,
-                    "nonce": 0,
-                    "data": multicall_call.data_in_transaction,
-                    "no_retry": not retry,
-                })
+                multicall_result = raw_response
             else:
-                assert isinstance(multicall_call, ContractFunction)
-                # manually encoding and decoding call because web3.py is sooooo slow...
-                # The simple but slow version is as below:
-                # _, multicall_result, completed_calls = multicall_call.call({
-                #     "from": self.CALLER_ADDRESS,
-                #     "nonce": 0,
-                #     "no_retry": not retry,
-                # })
-
-                calldata = to_bytes(hexstr=multicall_call.selector) + \
-                           eth_abi.encode(get_abi_input_types(multicall_call.abi), multicall_call.arguments)
-                raw_response = self.w3.eth.call({
-                    "from": self.CALLER_ADDRESS,
-                    "to": multicall_call.address,
-                    "nonce": 0,
-                    "data": calldata,
-                    "no_retry": not retry,
-                })
-                _, multicall_result = eth_abi.decode(get_abi_output_types(multicall_call.abi), raw_response)
+                _, multicall_result = eth_abi.decode(_multicall_function_encoding()[2], raw_response)
 
                 if len(multicall_result) > 0 and self.undeployed_contract_constructor is not None:
                     # remove first call result as that's the deployment of the undeployed contract
@@ -378,17 +662,6 @@ class MultiCall:
                     assert success, "Undeployed contract constructor reverted"
                     assert "0x" + address_encoded[-20:].hex() == self.undeployed_contract_address.lower(), "unexpected undeployed contract address"
                     multicall_result = multicall_result[1:]
-            if use_revert:
-                raise ValueError("Multicall did not revert but was expected to")
-        except ContractLogicError as e:
-            if not use_revert:
-                raise
-            if not e.message.startswith("execution reverted: "):
-                raise
-            result_str = e.message.removeprefix("execution reverted: ")
-            if any((char not in HEX_CHARS for char in result_str)):
-                raise
-            multicall_result = to_bytes(hexstr=result_str)
 
         if len(multicall_result) == 0:
             raise ValueError("No data returned from multicall")
@@ -397,10 +670,14 @@ class MultiCall:
 
     @staticmethod
     def decode_contract_function_result(raw_return: str | Exception, contract_function: ContractFunction):
+        return MultiCall._decode_raw_return(raw_return, _cached_abi_output_types(contract_function.abi))
+
+    @staticmethod
+    def _decode_raw_return(raw_return: bytes | Exception, output_types: list[str]):
         if isinstance(raw_return, Exception):
             return raw_return
         try:
-            result = eth_abi.decode(get_abi_output_types(contract_function.abi), raw_return)
+            result = eth_abi.decode(output_types, raw_return)
             if hasattr(result, "__len__") and len(result) == 1:
                 result = result[0]
             return result
@@ -409,21 +686,23 @@ class MultiCall:
 
     @staticmethod
     def decode_contract_function_results(raw_returns: list[str | Exception], contract_functions: list[ContractFunction]):
+        if len(contract_functions) > 1:
+            # batches mostly call the same function many times, its output types only need to be looked up once then
+            abi = contract_functions[0].abi
+            if all(contract_function.abi is abi for contract_function in contract_functions):
+                output_types = _cached_abi_output_types(abi)
+                return [MultiCall._decode_raw_return(raw_return, output_types) for raw_return in raw_returns]
         return [MultiCall.decode_contract_function_result(raw_return, contract_function) for raw_return, contract_function in zip(raw_returns, contract_functions)]
 
-
 def main(
         node_url="https://rpc-core.icecreamswap.com",
         usdt_address=to_checksum_address("0x900101d06A7426441Ae63e9AB3B9b0F63Be145F1"),
 ):
     w3 = Web3Advanced(node_url=node_url)
 
-    with files("IceCreamSwapWeb3").joinpath("./abi/Counter.abi").open('r') as f:
-        counter_contract_abi = f.read()
-    with files("IceCreamSwapWeb3").joinpath("./bytecode/Counter.bytecode").open('r') as f:
-        counter_contract_bytecode = f.read()
-    with files("IceCreamSwapWeb3").joinpath("./abi/ERC20.abi").open('r') as f:
-        erc20_abi = f.read()
+    counter_contract_abi = _load_abi("./abi/Counter.abi")
+    counter_contract_bytecode = _load_resource("./bytecode/Counter.bytecode")
+    erc20_abi = _load_abi("./abi/ERC20.abi")
 
     counter_contract = w3.eth.contract(bytecode=counter_contract_bytecode, abi=counter_contract_abi)
     usdt_contract = w3.eth.contract(address=usdt_address, abi=erc20_abi)
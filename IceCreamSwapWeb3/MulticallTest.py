@@ -0,0 +1,381 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+import eth_abi
+from eth_utils import keccak
+from eth_utils.abi import get_abi_input_types
+from web3.exceptions import ContractLogicError
+from web3.providers.base import JSONBaseProvider
+
+from .Multicall import MultiCall, _load_abi, _load_resource, _multicall_function_encoding
+from .Web3Advanced import Web3Advanced
+
+
+ADDRESS_A = "0x" + "aa" * 20
+ADDRESS_B = "0xBbBBbbBBbBBbbBbbbBbbbbBbBBbBbBbbbbbbbBBB"
+ZERO_ADDRESS = "0x" + "00" * 20
+CALL_DATA_1 = bytes.fromhex("06fdde03")
+CALL_DATA_2 = bytes.fromhex("70a08231") + bytes(12) + bytes.fromhex("11" * 20)
+
+# chain with a deployed multicall contract
+CHAIN_ID = 56
+MULTICALL_ADDRESS = MultiCall.MULTICALL_DEPLOYMENTS[CHAIN_ID]
+# fake contracts: balanceOf of TOKEN_ADDRESS returns the queried address as number, calls to POISON_ADDRESS make the
+# whole multicall fail
+TOKEN_ADDRESS = "0x" + "77" * 20
+POISON_ADDRESS = "0x" + "66" * 20
+COUNTER_SELECTOR = keccak(text="counter()")[:4]
+UPDATE_COUNTER_SELECTOR = keccak(text="updateCounter(uint256)")[:4]
+
+
+class FakeMulticallRPC(JSONBaseProvider):
+    # answers the requests of the Web3Advanced init and emulates multicallWithGasLimitation of the deployed multicall
+    endpoint_uri = "http://fake"
+
+    def __init__(self):
+        super().__init__()
+        self.multicall = MultiCall
+        # calls (target, calldata) of every executed multicall and sizes of all batch requests
+        self.executed: list[list[tuple[str, bytes]]] = []
+        self.batch_sizes: list[int] = []
+        # if set, only this many calls are executed per multicall, as if it ran out of gas
+        self.max_results: int | None = None
+        # if set, batch requests are answered with what this returns for the responses
+        self.batch_response = None
+        # block identifiers of all eth_calls to the multicall
+        self.block_identifiers: list = []
+
+    def _execute(self, calldata: bytes) -> bytes:
+        selector, _, output_types = _multicall_function_encoding()
+        assert calldata[:4] == selector
+        function_abi = next(abi for abi in _load_abi("./abi/Multicall.abi") if abi.get("name") == "multicallWithGasLimitation")
+        calls, _ = eth_abi.decode(get_abi_input_types(function_abi), calldata[4:])
+        self.executed.append([(target.lower(), call_data) for target, _, call_data in calls])
+        if any(target.lower() == POISON_ADDRESS for target, _, _ in calls):
+            raise ValueError("poisoned multicall")
+        if self.max_results is not None:
+            calls = calls[:self.max_results]
+
+        counter = 13
+        results = []
+        for target, _, call_data in calls:
+            if target.lower() == MULTICALL_ADDRESS.lower():
+                # deployment of the undeployed contract, returning its address
+                results.append((True, 1, bytes(12) + bytes.fromhex(self.multicall.undeployed_contract_address[2:])))
+            elif target.lower() == self.multicall.undeployed_contract_address.lower() and call_data[:4] == COUNTER_SELECTOR:
+                results.append((True, 2, counter.to_bytes(32, "big")))
+            elif target.lower() == self.multicall.undeployed_contract_address.lower() and call_data[:4] == UPDATE_COUNTER_SELECTOR:
+                counter = int.from_bytes(call_data[4:36], "big")
+                results.append((True, 3, b""))
+            elif target.lower() == TOKEN_ADDRESS:
+                results.append((True, 4, call_data[4:36]))
+            else:
+                results.append((False, 5, b""))
+        return eth_abi.encode(output_types, [1, results])
+
+    def make_request(self, method, params, request_id=0):
+        params = json.loads(self.encode_rpc_request(method, params))["params"]
+        response = {"jsonrpc": "2.0", "id": request_id}
+        if method == "eth_chainId":
+            response["result"] = hex(CHAIN_ID)
+        elif method == "eth_blockNumber":
+            response["result"] = hex(1_000_000)
+        elif method == "eth_getLogs":
+            response["result"] = []
+        elif method == "eth_gasPrice":
+            response["result"] = hex(1)
+        elif method == "eth_call" and params[0].get("to", "").lower() == MULTICALL_ADDRESS.lower():
+            self.block_identifiers.append(params[1])
+            if not isinstance(params[1], str):
+                response["error"] = {"code": -32602, "message": "invalid block identifier"}
+                return response
+            try:
+                response["result"] = "0x" + self._execute(bytes.fromhex(params[0]["data"][2:])).hex()
+            except ValueError as e:
+                response["error"] = {"code": 3, "message": f"execution reverted: {e}"}
+        else:
+            response["error"] = {"code": -32601, "message": f"unsupported {method}"}
+        return response
+
+    def make_batch_request(self, requests):
+        self.batch_sizes.append(len(requests))
+        responses = [self.make_request(method, params, request_id) for request_id, (method, params) in enumerate(requests)]
+        if self.batch_response is not None:
+            return self.batch_response(responses)
+        return responses
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+
+def fake_web3() -> tuple[Web3Advanced, FakeMulticallRPC]:
+    provider = FakeMulticallRPC()
+    with patch.object(Web3Advanced, "_construct_provider", return_value=provider), \
+            patch("IceCreamSwapWeb3.Web3Advanced.sleep"):
+        w3 = Web3Advanced(node_url="http://fake", cache_rpc_limits=False)
+    return w3, provider
+
+
+def start_multicall(w3: Web3Advanced, provider: FakeMulticallRPC, dedupe_reads: bool = False) -> MultiCall:
+    multicall = w3.start_multicall(dedupe_reads=dedupe_reads)
+    provider.multicall = multicall
+    return multicall
+
+
+def undeployed_multicall():
+    # a MultiCall for the undeployed multicall contract without a Web3 instance, capturing the constructor arguments
+    multicall = object.__new__(MultiCall)
+    multicall.multicall = MagicMock()
+    multicall.multicall.address = None
+    multicall.undeployed_contract_constructor = None
+    return multicall
+
+
+def encode_segment(success: bool, gas_usage: int, raw_return: bytes) -> bytes:
+    # a single result as returned by the undeployed multicall: length including itself, success, gas usage, return data
+    data = bytes([1 if success else 0]) + gas_usage.to_bytes(4, "big") + raw_return
+    return (len(data) + 2).to_bytes(2, "big") + data
+
+
+class TestBuildConstructorCalldata(unittest.TestCase):
+
+    def build_encoded_calls(self, calls_with_calldata: list) -> bytes:
+        multicall = undeployed_multicall()
+        multicall._build_constructor_calldata(calls_with_calldata, use_revert=True)
+        kwargs = multicall.multicall.constructor.call_args.kwargs
+        self.assertEqual(kwargs["useRevert"], True)
+        self.assertEqual(kwargs["contractBytecode"], b"")
+        return kwargs["encodedCalls"]
+
+    def test_no_calls(self):
+        self.assertEqual(self.build_encoded_calls([]), bytes(32))
+
+    def test_packed_encoding(self):
+        call_a = MagicMock(address=ADDRESS_A)
+        call_b = MagicMock(address=ADDRESS_B)
+        encoded_calls = self.build_encoded_calls([
+            (call_a, CALL_DATA_1, False),
+            (call_a, CALL_DATA_1, False),  # same target and calldata
+            (call_a, CALL_DATA_2, False),  # same target
+            (call_b, CALL_DATA_2, False),  # same calldata
+            (call_b, CALL_DATA_2, True),  # undeployed contract, same calldata
+            (call_a, b"", True),  # undeployed contract again, empty calldata
+        ])
+        expected = (
+            (6).to_bytes(32, "big")
+            + b"\x00" + bytes.fromhex(ADDRESS_A[2:]) + len(CALL_DATA_1).to_bytes(2, "big") + CALL_DATA_1
+            + b"\x03"
+            + b"\x01" + len(CALL_DATA_2).to_bytes(2, "big") + CALL_DATA_2
+            + b"\x02" + bytes.fromhex(ADDRESS_B[2:])
+            + b"\x02" + bytes.fromhex(ZERO_ADDRESS[2:])
+            + b"\x01" + (0).to_bytes(2, "big")
+        )
+        self.assertEqual(encoded_calls, expected)
+        self.assertIs(type(encoded_calls), bytes)
+
+
+class TestDecodeMulticall(unittest.TestCase):
+
+    def test_undeployed_multicall_result(self):
+        revert_data = bytes.fromhex("08c379a0") + eth_abi.encode(["string"], ["not allowed"])
+        multicall_result = (
+            encode_segment(True, 21_000, eth_abi.encode(["uint256"], [7]))
+            + encode_segment(True, 0, b"")
+            + encode_segment(False, 2 ** 32 - 1, revert_data)
+            + encode_segment(False, 5, b"")
+        )
+        raw_returns, gas_usages = MultiCall._decode_muilticall(multicall_result)
+
+        self.assertEqual(gas_usages, [21_000, 0, 2 ** 32 - 1, 5])
+        self.assertEqual(raw_returns[:2], [eth_abi.encode(["uint256"], [7]), b""])
+        self.assertEqual([type(raw_return) for raw_return in raw_returns[:2]], [bytes, bytes])
+        self.assertIsInstance(raw_returns[2], ContractLogicError)
+        self.assertIn("not allowed", str(raw_returns[2]))
+        self.assertIsInstance(raw_returns[3], ContractLogicError)
+        self.assertIn("unknown", str(raw_returns[3]))
+
+    def test_truncated_segment(self):
+        # a segment too short to hold success flag and gas usage is returned as exception without gas usage
+        multicall_result = encode_segment(True, 1, b"\x01") + (2).to_bytes(2, "big")
+        raw_returns, gas_usages = MultiCall._decode_muilticall(multicall_result)
+
+        self.assertEqual(raw_returns[0], b"\x01")
+        self.assertIsInstance(raw_returns[1], Exception)
+        self.assertEqual(gas_usages, [1, None])
+
+    def test_empty_result(self):
+        self.assertEqual(MultiCall._decode_muilticall(b""), ([], []))
+
+    def test_deployed_multicall_result(self):
+        raw_returns, gas_usages = MultiCall._decode_muilticall([(True, 100, b"\x01"), (False, 200, b"")])
+
+        self.assertEqual(raw_returns[0], b"\x01")
+        self.assertIsInstance(raw_returns[1], ContractLogicError)
+        self.assertEqual(gas_usages, [100, 200])
+
+    def test_gas_usages(self):
+        # gas usages are 4 byte big endian integers
+        multicall_result = b"".join(encode_segment(True, gas_usage, b"") for gas_usage in (0, 1, 2 ** 16, 2 ** 32 - 1))
+        _, gas_usages = MultiCall._decode_muilticall(multicall_result)
+
+        self.assertEqual(gas_usages, [0, 1, 2 ** 16, 2 ** 32 - 1])
+
+
+
+class TestMulticallCalls(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.w3, cls.provider = fake_web3()
+        cls.token = cls.w3.eth.contract(address=cls.w3.to_checksum_address(TOKEN_ADDRESS), abi=_load_abi("./abi/ERC20.abi"))
+        cls.counter = cls.w3.eth.contract(abi=_load_abi("./abi/Counter.abi"), bytecode=_load_resource("./bytecode/Counter.bytecode"))
+
+    def setUp(self):
+        self.provider.executed.clear()
+        self.provider.batch_sizes.clear()
+        self.provider.max_results = None
+        self.provider.batch_response = None
+        self.provider.block_identifiers.clear()
+        self.w3.rpc_batch_max_size = 1_000
+        # the multicall prints failed batches
+        print_patcher = patch("builtins.print")
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def balance_of(self, holder: int):
+        return self.token.functions.balanceOf(self.w3.to_checksum_address(holder.to_bytes(20, "big")))
+
+    def poisoned_call(self):
+        token = self.w3.eth.contract(address=self.w3.to_checksum_address(POISON_ADDRESS), abi=_load_abi("./abi/ERC20.abi"))
+        return token.functions.balanceOf(self.w3.to_checksum_address(POISON_ADDRESS))
+
+    def balances_multicall(self, holders: list[int], dedupe_reads: bool = False) -> MultiCall:
+        multicall = start_multicall(self.w3, self.provider, dedupe_reads=dedupe_reads)
+        for holder in holders:
+            multicall.add_call(self.balance_of(holder))
+        return multicall
+
+    def test_calls_appended_directly_between_undeployed_calls(self):
+        multicall = start_multicall(self.w3, self.provider)
+        multicall.add_undeployed_contract(self.counter.constructor(initialCounter=13))
+        multicall.calls.append(self.balance_of(1))
+        multicall.add_undeployed_contract_call(self.counter.functions.counter())
+        multicall.calls.append(self.balance_of(2))
+
+        self.assertEqual(multicall.call(), [1, 13, 2])
+        targets = [target for target, _ in self.provider.executed[0]]
+        self.assertEqual(targets, [
+            MULTICALL_ADDRESS.lower(), TOKEN_ADDRESS, multicall.undeployed_contract_address.lower(), TOKEN_ADDRESS
+        ])
+
+
+    def test_batched_rounds(self):
+        multicall = self.balances_multicall(list(range(1, 11)))
+        self.assertEqual(multicall.call(batch_size=4, batched=True), list(range(1, 11)))
+        # all 3 multicalls are sent in a single batch request
+        self.assertEqual(self.provider.batch_sizes, [3])
+        self.assertEqual([len(calls) for calls in self.provider.executed], [4, 4, 2])
+
+    def test_batched_split_halves_in_next_round(self):
+        multicall = self.balances_multicall(list(range(1, 11)))
+        multicall.calls[5] = self.poisoned_call()
+        results = multicall.call(batch_size=4, batched=True)
+
+        self.assertEqual(results[:5] + results[6:], [1, 2, 3, 4, 5, 7, 8, 9, 10])
+        self.assertIsInstance(results[5], Exception)
+        # the failing multicall is split in halves, which are sent together in the next round, until the failing call
+        # is alone. That one is called on its own with retries
+        self.assertEqual(self.provider.batch_sizes, [3, 2, 2])
+        self.assertEqual([len(calls) for calls in self.provider.executed], [4, 4, 2, 2, 2, 1, 1, 1])
+
+    def test_batched_falls_back_to_single_calls(self):
+        for batch_response in (
+            lambda responses: {"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "batch too large"}},
+            lambda responses: responses[:-1],
+        ):
+            with self.subTest(batch_response=batch_response):
+                self.provider.executed.clear()
+                self.provider.batch_response = batch_response
+                multicall = self.balances_multicall(list(range(1, 11)))
+                self.assertEqual(multicall.call(batch_size=4, batched=True), list(range(1, 11)))
+                # the 3 multicalls of the failed batch request are called one by one
+                self.assertEqual([len(calls) for calls in self.provider.executed], [4, 4, 2] * 2)
+
+    def test_batched_with_integer_default_block(self):
+        self.w3.eth.default_block = 999_990
+        self.addCleanup(setattr, self.w3.eth, "default_block", "latest")
+        multicall = self.balances_multicall(list(range(1, 11)))
+
+        self.assertEqual(multicall.call(batch_size=4, batched=True), list(range(1, 11)))
+        self.assertEqual(self.provider.block_identifiers, [hex(999_990)] * 3)
+
+
+    def test_dedupe_fans_out_results(self):
+        multicall = self.balances_multicall([1, 2, 1, 3, 2, 1], dedupe_reads=True)
+        self.assertEqual(multicall.call(), [1, 2, 1, 3, 2, 1])
+        # identical calls are executed once
+        self.assertEqual(len(self.provider.executed), 1)
+        self.assertEqual([call_data[4:36] for _, call_data in self.provider.executed[0]], [holder.to_bytes(32, "big") for holder in (1, 2, 3)])
+
+        indexes = [index for index, _, _ in multicall.iter_call_with_gas()]
+        self.assertEqual(sorted(indexes), list(range(6)))
+
+    def test_dedupe_skips_undeployed_calls(self):
+        multicall = start_multicall(self.w3, self.provider, dedupe_reads=True)
+        multicall.add_undeployed_contract(self.counter.constructor(initialCounter=13))
+        multicall.add_call(self.balance_of(1))
+        multicall.add_undeployed_contract_call(self.counter.functions.counter())
+        multicall.add_undeployed_contract_call(self.counter.functions.updateCounter(newCounter=7))
+        multicall.add_undeployed_contract_call(self.counter.functions.counter())
+        multicall.add_call(self.balance_of(1))
+
+        self.assertEqual(multicall.call(), [1, 13, (), 7, 1])
+        # deployment, the single balance call and all 3 undeployed contract calls
+        self.assertEqual([len(calls) for calls in self.provider.executed], [5])
+
+
+    def test_iter_call_with_gas_ascending(self):
+        multicall = self.balances_multicall(list(range(1, 11)))
+        self.assertEqual(
+            list(multicall.iter_call_with_gas(batch_size=3)),
+            [(index, index + 1, 4) for index in range(10)]
+        )
+
+    def test_iter_call_with_gas_every_index_once(self):
+        for kwargs in ({"batched": True}, {"dedupe": True}):
+            with self.subTest(**kwargs):
+                multicall = self.balances_multicall(list(range(1, 11)) * 2, dedupe_reads=kwargs.get("dedupe", False))
+                multicall.calls[5] = self.poisoned_call()
+                results = list(multicall.iter_call_with_gas(batch_size=3, batched=kwargs.get("batched", False)))
+                self.assertEqual(sorted(index for index, _, _ in results), list(range(20)))
+
+    def test_call_with_gas(self):
+        multicall = self.balances_multicall([1, 2, 3])
+        multicall.calls.insert(1, self.poisoned_call())
+        results, gas_usages = multicall.call_with_gas()
+        self.assertEqual([results[0]] + results[2:], [1, 2, 3])
+        self.assertIsInstance(results[1], Exception)
+        self.assertEqual(gas_usages, [4, None, 4, 4])
+
+
+    def test_remainder_executed_after_running_out_of_gas(self):
+        # each multicall only executes 3 calls. The last result might be cut short, so only 2 are used
+        self.provider.max_results = 3
+        multicall = self.balances_multicall(list(range(1, 11)))
+        self.assertEqual(multicall.call(batch_size=5), list(range(1, 11)))
+        self.assertEqual([len(calls) for calls in self.provider.executed], [5, 3, 5, 3])
+
+    def test_failed_batches_split(self):
+        multicall = self.balances_multicall(list(range(1, 11)))
+        multicall.calls[5] = self.poisoned_call()
+        results = multicall.call(batch_size=4)
+
+        self.assertEqual(results[:5] + results[6:], [1, 2, 3, 4, 5, 7, 8, 9, 10])
+        self.assertIsInstance(results[5], Exception)
+        # the failing batch is split depth first, the failing call alone is tried once more with retries
+        self.assertEqual([len(calls) for calls in self.provider.executed], [4, 4, 2, 1, 1, 1, 2, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,65 @@
+import json
 import os
+from hashlib import sha256
 from importlib.resources import files
-from time import sleep
+from time import sleep, time
+from types import MethodType
+from typing import Optional
 
+import requests
+from requests.adapters import HTTPAdapter
 from web3 import Web3
+from web3.contract import Contract
 from web3.exceptions import ContractLogicError
 from web3.main import get_default_modules
 from web3.middleware import ExtraDataToPOAMiddleware
+from web3._utils.encoding import Web3JsonEncoder
+from web3.providers.base import JSONBaseProvider
 
 from .BatchRetryMiddleware import BatchRetryMiddleware
-from .EthAdvanced import EthAdvanced
+from .EthAdvanced import EthAdvanced, parse_max_block_range
 from .Multicall import MultiCall
 from .Web3ErrorHandlerPatch import patch_error_formatters
 from .FastChecksumAddress import to_checksum_address
 
+try:
+    # optional dependency, en- and decodes (batch) RPC requests and responses a lot faster than the standard json module.
+    # quantities in RPC responses are hex strings, so orjson turning huge integers into floats is no concern
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _decode_rpc_response(raw_response: bytes):
+    try:
+        return orjson.loads(raw_response)
+    except orjson.JSONDecodeError:
+        # orjson is stricter than the standard json module, e.g. regarding NaN or invalid unicode
+        return JSONBaseProvider.decode_rpc_response(raw_response)
+
+
+_WEB3_JSON_ENCODER = Web3JsonEncoder()
+
+
+def _encode_rpc_request(provider: JSONBaseProvider, method, params) -> bytes:
+    rpc_dict = {
+        "jsonrpc": "2.0",
+        "method": method,
+        "params": params or [],
+        "id": next(provider.request_counter),
+    }
+    try:
+        # web3's encoder takes care of types like HexBytes and AttributeDict
+        return orjson.dumps(rpc_dict, default=_WEB3_JSON_ENCODER.default)
+    except orjson.JSONEncodeError:
+        # orjson can not encode integers above 64 bit
+        return json.dumps(rpc_dict, cls=Web3JsonEncoder).encode()
+
+
+# if enabled, probed RPC limits are cached on disk for a day, so not every start has to probe them again
+RPC_LIMITS_CACHE_FILE = os.getenv("RPC_LIMITS_CACHE_FILE", os.path.join(os.path.expanduser("~"), ".cache", "icecreamswap", "rpc_limits.json"))
+RPC_LIMITS_CACHE_TTL = 24 * 60 * 60
+
 
 class Web3Advanced(Web3):
     eth: EthAdvanced
@@ -53,13 +100,22 @@ class Web3Advanced(Web3):
             node_url: str,
             should_retry: bool = True,
             unstable_blocks: int = int(os.getenv("UNSTABLE_BLOCKS", 5)),  # not all nodes might have latest n blocks, these are seen as unstable
+            max_parallel_requests: int = int(os.getenv("MAX_PARALLEL_REQUESTS", 8)),  # max concurrent RPC requests of a single call like get_logs
+            small_get_logs_threshold: int = int(os.getenv("SMALL_GET_LOGS_THRESHOLD", 3)),  # stable ranges up to this many blocks are queried directly
+            cache_rpc_limits: bool = os.getenv("RPC_LIMITS_CACHE") is not None,  # opt-in: cache probed filter range and batch size on disk
+            use_logs_bloom: bool = os.getenv("USE_LOGS_BLOOM") is not None,  # skip blocks by logs bloom when getting logs by block hash. Some chains leave logs out of it
     ):
         patch_error_formatters()
         self.node_url = node_url
         self.should_retry = should_retry
         self.unstable_blocks = unstable_blocks
+        self.max_parallel_requests = max_parallel_requests
+        self.small_get_logs_threshold = small_get_logs_threshold
+        self.use_logs_bloom = use_logs_bloom
+        # multicall contracts by address, None for the undeployed multicall. Building them takes milliseconds
+        self.multicall_contracts: dict[Optional[str], Contract | type[Contract]] = {}
 
-        provider = self._construct_provider(node_url=self.node_url)
+        provider = self._construct_provider(node_url=self.node_url, max_parallel_requests=self.max_parallel_requests)
 
         # use the EthAdvanced class instead of the Eth class for w3.eth
         modules = get_default_modules()
@@ -71,8 +127,15 @@ class Web3Advanced(Web3):
 
         self.latest_seen_block = self.eth.get_block_number(ignore_latest_seen_block=True)
 
-        self.filter_block_range = self._find_max_filter_range()
-        self.rpc_batch_max_size = self._find_max_batch_size()
+        rpc_limits = self._load_rpc_limits() if cache_rpc_limits else None
+        if rpc_limits is not None:
+            self.filter_block_range, self.rpc_batch_max_size = rpc_limits
+        else:
+            self.filter_block_range = self._find_max_filter_range()
+            self.rpc_batch_max_size = self._find_max_batch_size()
+            # not caching a failed probe, the RPC might just have been down
+            if cache_rpc_limits and self.filter_block_range != 0:
+                self._store_rpc_limits()
         self.revert_reason_available: bool = self._check_revert_reason_available()
         if not self.revert_reason_available:
             print(f"RPC {self.node_url} does not return revert reasons")
@@ -80,22 +143,34 @@ class Web3Advanced(Web3):
         self.middleware_onion.inject(BatchRetryMiddleware, layer=0, name="batch_retry")  # split and retry batch requests
 
     @staticmethod
-    def _construct_provider(node_url):
+    def _construct_provider(node_url, max_parallel_requests: int = 8):
         assert "://" in node_url
         protocol = node_url.split("://")[0]
         if protocol in ("https", "http"):
-            return Web3.HTTPProvider(node_url)
+            # by default web3 creates a session per thread, so parallel requests from worker threads
+            # would open new connections every time. Sharing one pooled session keeps them alive.
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(max_parallel_requests, 10))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            provider = Web3.HTTPProvider(node_url, session=session)
+            if orjson is not None:
+                provider.encode_rpc_request = MethodType(_encode_rpc_request, provider)
+                provider.decode_rpc_response = _decode_rpc_response
+            return provider
         elif protocol in ("ws", "wss"):
             return Web3.WebsocketProvider(node_url)
         else:
             raise ValueError(f"Unknown protocol for RPC URL {node_url}")
 
-    def start_multicall(self) -> MultiCall:
-        return MultiCall(w3=self)
+    def start_multicall(self, dedupe_reads: bool = False) -> MultiCall:
+        return MultiCall(w3=self, dedupe_reads=dedupe_reads)
 
     def _find_max_filter_range(self) -> int:
-        current_block = self.eth.block_number
-        for filter_range in self.FILTER_RANGES_TO_TRY:
+        # fetched right before in the init, no need to ask the RPC again
+        current_block = self.latest_seen_block
+
+        def filter_range_error(filter_range: int) -> Exception | None:
             try:
                 # getting logs from the 0 address as it does not emit any logs.
                 # This way we can test the maximum allowed filter range without getting back a ton of logs
@@ -105,11 +180,35 @@ class Web3Advanced(Web3):
                     "toBlock": current_block - 5,
                 })
                 assert result == []
-                return filter_range
-            except Exception:
+                return None
+            except Exception as e:
                 sleep(0.1)
-        print(f"Can not use eth_getLogs with RPC {self.node_url}")
-        return 0
+                return e
+
+        # most RPCs support the largest range, so try it first
+        error = filter_range_error(self.FILTER_RANGES_TO_TRY[0])
+        if error is None:
+            return self.FILTER_RANGES_TO_TRY[0]
+
+        # many RPCs state their limit in the error message, which saves searching for it
+        max_block_range = parse_max_block_range(error)
+        if max_block_range is not None and max_block_range < self.FILTER_RANGES_TO_TRY[0]:
+            if filter_range_error(max_block_range) is None:
+                return max_block_range
+
+        # binary search the remaining ranges, assuming that all ranges below a working one work as well.
+        # works_idx is the smallest index known to work, fails_idx the largest index known to fail
+        works_idx, fails_idx = len(self.FILTER_RANGES_TO_TRY), 0
+        while works_idx - fails_idx > 1:
+            middle = (works_idx + fails_idx) // 2
+            if filter_range_error(self.FILTER_RANGES_TO_TRY[middle]) is None:
+                works_idx = middle
+            else:
+                fails_idx = middle
+        if works_idx == len(self.FILTER_RANGES_TO_TRY):
+            print(f"Can not use eth_getLogs with RPC {self.node_url}")
+            return 0
+        return self.FILTER_RANGES_TO_TRY[works_idx]
 
     def _find_max_batch_size(self) -> int:
         working_size = 0
@@ -126,6 +225,44 @@ class Web3Advanced(Web3):
             pass
         return working_size
 
+    def _rpc_limits_cache_key(self) -> str:
+        # hashing the node URL, as it might contain an API key
+        return sha256(f"{self.eth.chain_id}:{self.node_url}".encode()).hexdigest()
+
+    def _load_rpc_limits(self) -> tuple[int, int] | None:
+        try:
+            with open(RPC_LIMITS_CACHE_FILE, "r") as f:
+                entry = json.load(f)[self._rpc_limits_cache_key()]
+            if time() - entry["timestamp"] > RPC_LIMITS_CACHE_TTL:
+                return None
+            return entry["filter_block_range"], entry["rpc_batch_max_size"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _store_rpc_limits(self):
+        now = time()
+        try:
+            with open(RPC_LIMITS_CACHE_FILE, "r") as f:
+                cache = json.load(f)
+            # dropping expired entries
+            cache = {key: entry for key, entry in cache.items() if now - entry["timestamp"] <= RPC_LIMITS_CACHE_TTL}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            cache = {}
+        cache[self._rpc_limits_cache_key()] = {
+            "timestamp": now,
+            "filter_block_range": self.filter_block_range,
+            "rpc_batch_max_size": self.rpc_batch_max_size,
+        }
+        try:
+            os.makedirs(os.path.dirname(RPC_LIMITS_CACHE_FILE), exist_ok=True)
+            # writing to a temporary file first, so parallel processes never read a partially written cache
+            tmp_file = f"{RPC_LIMITS_CACHE_FILE}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_file, RPC_LIMITS_CACHE_FILE)
+        except OSError as e:
+            print(f"Could not cache RPC limits: {repr(e)}")
+
     def _check_revert_reason_available(self):
         with files("IceCreamSwapWeb3").joinpath("./abi/RevertTester.abi").open('r') as f:
             revert_tester_abi = f.read()
@@ -0,0 +1,170 @@
+import json
+import os
+import unittest
+from hashlib import sha256
+from tempfile import TemporaryDirectory
+from time import time
+from unittest.mock import MagicMock, patch
+
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+from web3.providers.base import JSONBaseProvider
+
+from .Web3Advanced import RPC_LIMITS_CACHE_TTL, Web3Advanced, _decode_rpc_response, _encode_rpc_request, orjson
+
+
+def web3_with_logs_limit(max_range: int | None, error_message: str = "block range too large") -> Web3Advanced:
+    # a Web3Advanced without RPC, whose eth_getLogs fails for ranges above max_range, or always if it is None
+    w3 = object.__new__(Web3Advanced)
+    w3.node_url = "http://fake"
+    w3.latest_seen_block = 1_000_000
+    w3.eth = MagicMock()
+
+    def get_logs(filter_params):
+        filter_range = filter_params["toBlock"] - filter_params["fromBlock"] + 1
+        if max_range is None or filter_range > max_range:
+            raise ValueError(error_message)
+        return []
+    w3.eth._get_logs.side_effect = get_logs
+    return w3
+
+
+@patch("IceCreamSwapWeb3.Web3Advanced.sleep")
+class TestFindMaxFilterRange(unittest.TestCase):
+
+    def test_supported_ranges(self, mock_sleep):
+        for max_range in Web3Advanced.FILTER_RANGES_TO_TRY:
+            with self.subTest(max_range=max_range):
+                self.assertEqual(web3_with_logs_limit(max_range)._find_max_filter_range(), max_range)
+
+    def test_between_ranges(self, mock_sleep):
+        # the largest range to try below the actual limit is found
+        self.assertEqual(web3_with_logs_limit(3_000)._find_max_filter_range(), 2_000)
+        self.assertEqual(web3_with_logs_limit(15_000)._find_max_filter_range(), 10_000)
+
+    @patch("builtins.print")
+    def test_nothing_works(self, mock_print, mock_sleep):
+        self.assertEqual(web3_with_logs_limit(None)._find_max_filter_range(), 0)
+
+    def test_binary_search_request_count(self, mock_sleep):
+        w3 = web3_with_logs_limit(50)
+        w3._find_max_filter_range()
+        # the largest range first, then a binary search over the remaining 12 ranges
+        self.assertLessEqual(w3.eth._get_logs.call_count, 1 + 4)
+
+    def test_stated_limit(self, mock_sleep):
+        # a limit stated in the error message is probed directly, even if it is not one of the ranges to try
+        w3 = web3_with_logs_limit(3_000, "exceed maximum block range: 3000")
+        self.assertEqual(w3._find_max_filter_range(), 3_000)
+        self.assertEqual(w3.eth._get_logs.call_count, 2)
+
+    def test_wrong_stated_limit(self, mock_sleep):
+        # falling back to the binary search if the stated limit does not work either
+        w3 = web3_with_logs_limit(1_000, "exceed maximum block range: 3000")
+        self.assertEqual(w3._find_max_filter_range(), 1_000)
+
+
+class TestRpcLimitsCache(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_file = os.path.join(temp_dir.name, "cache", "rpc_limits.json")
+        cache_file_patcher = patch("IceCreamSwapWeb3.Web3Advanced.RPC_LIMITS_CACHE_FILE", self.cache_file)
+        cache_file_patcher.start()
+        self.addCleanup(cache_file_patcher.stop)
+
+    @staticmethod
+    def web3(node_url: str = "https://rpc.example/secret-api-key", chain_id: int = 56) -> Web3Advanced:
+        w3 = object.__new__(Web3Advanced)
+        w3.node_url = node_url
+        w3.eth = MagicMock()
+        w3.eth.chain_id = chain_id
+        w3.filter_block_range = 5_000
+        w3.rpc_batch_max_size = 200
+        return w3
+
+    def test_round_trip(self):
+        self.assertIsNone(self.web3()._load_rpc_limits())
+        self.web3()._store_rpc_limits()
+        self.assertEqual(self.web3()._load_rpc_limits(), (5_000, 200))
+        # limits are per chain and node
+        self.assertIsNone(self.web3(node_url="https://other.example")._load_rpc_limits())
+        self.assertIsNone(self.web3(chain_id=1)._load_rpc_limits())
+
+    def test_key_hides_node_url(self):
+        self.web3()._store_rpc_limits()
+        with open(self.cache_file) as f:
+            content = f.read()
+        self.assertNotIn("secret-api-key", content)
+        self.assertEqual(list(json.loads(content)), [sha256("56:https://rpc.example/secret-api-key".encode()).hexdigest()])
+
+    def test_expiry(self):
+        self.web3()._store_rpc_limits()
+        with patch("IceCreamSwapWeb3.Web3Advanced.time", return_value=time() + RPC_LIMITS_CACHE_TTL + 1):
+            self.assertIsNone(self.web3()._load_rpc_limits())
+            # expired entries are dropped when storing
+            self.web3(node_url="https://other.example")._store_rpc_limits()
+        with open(self.cache_file) as f:
+            self.assertEqual(len(json.load(f)), 1)
+
+    def test_corrupt_file(self):
+        os.makedirs(os.path.dirname(self.cache_file))
+        for content in ("{not json", "[]", '{"%s": {}}' % self.web3()._rpc_limits_cache_key()):
+            with self.subTest(content=content):
+                with open(self.cache_file, "w") as f:
+                    f.write(content)
+                self.assertIsNone(self.web3()._load_rpc_limits())
+                # storing replaces a corrupt cache
+                self.web3()._store_rpc_limits()
+                self.assertEqual(self.web3()._load_rpc_limits(), (5_000, 200))
+
+
+@unittest.skipIf(orjson is None, "orjson not installed")
+class TestRpcEncoding(unittest.TestCase):
+
+    PARAMS = [
+        HexBytes("0x0102"),
+        AttributeDict({"to": HexBytes("0x" + "ab" * 20), "nested": AttributeDict({"value": 1})}),
+        "latest",
+        2 ** 64 - 1,
+    ]
+
+    def test_encode_matches_web3(self):
+        for params in (self.PARAMS, [], None, [2 ** 70], [{"value": -2 ** 64}]):
+            with self.subTest(params=params):
+                # fresh providers, so both requests get the same id
+                encoded = _encode_rpc_request(JSONBaseProvider(), "eth_call", params)
+                self.assertEqual(json.loads(encoded), json.loads(JSONBaseProvider().encode_rpc_request("eth_call", params)))
+
+    def test_batch_encoding_uses_orjson(self):
+        provider = Web3Advanced._construct_provider("http://localhost:8545")
+        encoded = provider.encode_batch_rpc_request([("eth_call", self.PARAMS), ("eth_blockNumber", [])])
+        # orjson writes compact JSON, while the standard json module adds spaces after separators
+        self.assertIn(b'{"jsonrpc":"2.0","method":"eth_call"', encoded)
+        self.assertEqual(
+            [request["method"] for request in json.loads(encoded)],
+            ["eth_call", "eth_blockNumber"]
+        )
+
+    def test_decode_matches_web3(self):
+        for raw_response in (
+            b'{"jsonrpc":"2.0","id":1,"result":"0x1"}',
+            b'[{"jsonrpc":"2.0","id":1,"result":null},{"jsonrpc":"2.0","id":2,"error":{"code":-32000,"message":"x"}}]',
+        ):
+            with self.subTest(raw_response=raw_response):
+                self.assertEqual(_decode_rpc_response(raw_response), JSONBaseProvider.decode_rpc_response(raw_response))
+
+    def test_decode_falls_back_to_web3(self):
+        # NaN is accepted by the standard json module, but not by orjson
+        raw_response = b'{"jsonrpc":"2.0","id":1,"result":NaN}'
+        with patch.object(JSONBaseProvider, "decode_rpc_response", wraps=JSONBaseProvider.decode_rpc_response) as mock_decode:
+            response = _decode_rpc_response(raw_response)
+        mock_decode.assert_called_once_with(raw_response)
+        # NaN is the only value not equal to itself
+        self.assertNotEqual(response["result"], response["result"])
+        self.assertIs(Web3Advanced._construct_provider("http://localhost:8545").decode_rpc_response, _decode_rpc_response)
+
+
+if __name__ == '__main__':
+    unittest.main()
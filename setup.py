@@ -6,7 +6,6 @@ LONG_DESCRIPTION = 'IceCreamSwap Web3.py wrapper with automatic retries, multica
 
 requirements = [
     'web3>=7,<8',
-    'rlp',
 ]
 
 # Setting up